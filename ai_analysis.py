@@ -1,11 +1,19 @@
 """
 AI-powered clothing analysis using Google GenAI SDK (v1)
+
+Calls go through the SDK's async client (client.aio) with a timeout per
+model, and image decoding runs in a worker thread, so a slow Gemini call
+never blocks the event loop. Candidate models are hedged: the next one
+starts if the previous hasn't answered within GEMINI_HEDGE_DELAY or has
+failed, the first valid answer wins and the other calls are cancelled.
 """
 from google.genai import Client, types
+import asyncio
 import json
 import logging
-from typing import Dict, Optional, Any
+from typing import Dict, List, Optional, Any
 from io import BytesIO
+from config import GEMINI_MODEL_TIMEOUT, GEMINI_HEDGE_DELAY
 
 logger = logging.getLogger(__name__)
 
@@ -26,6 +34,80 @@ def init_gemini(api_key: str):
     except Exception as e:
         logger.error(f"Failed to initialize Gemini Client: {e}")
 
+def _load_image(photo_bytes: bytes):
+    import PIL.Image
+    image = PIL.Image.open(BytesIO(photo_bytes))
+    # open() is lazy; decode here, off the event loop
+    image.load()
+    return image
+
+async def _generate_json(model_name: str, contents) -> Dict:
+    """One model call with a timeout; returns the parsed JSON answer."""
+    try:
+        response = await asyncio.wait_for(
+            client.aio.models.generate_content(
+                model=model_name,
+                contents=contents,
+                config=types.GenerateContentConfig(
+                    response_mime_type="application/json"
+                )
+            ),
+            GEMINI_MODEL_TIMEOUT
+        )
+    except asyncio.TimeoutError:
+        raise TimeoutError(f"no answer in {GEMINI_MODEL_TIMEOUT:g}s")
+
+    if not response.text:
+        raise ValueError("Empty response from AI")
+    data = json.loads(response.text)
+    data['success'] = True
+    return data
+
+async def _hedged_generate(candidates: List[str], contents, purpose: str) -> Dict:
+    """
+    Races the candidate models in order: the first starts at once and each
+    next one after GEMINI_HEDGE_DELAY seconds, or as soon as a running call
+    fails. Returns the first successful answer and cancels the rest; raises
+    the last error if every model fails.
+    """
+    queue = list(candidates)
+    running: Dict[asyncio.Task, str] = {}
+    last_error: Optional[Exception] = None
+
+    def launch():
+        model_name = queue.pop(0)
+        logger.info(f"Attempting {purpose} with model: {model_name}")
+        running[asyncio.create_task(_generate_json(model_name, contents))] = model_name
+
+    launch()
+    try:
+        while running:
+            done, _ = await asyncio.wait(
+                running, timeout=GEMINI_HEDGE_DELAY if queue else None, return_when=asyncio.FIRST_COMPLETED
+            )
+            if not done:
+                # Slow, not failed: keep it running and hedge with the next model
+                launch()
+                continue
+            for task in done:
+                model_name = running.pop(task)
+                try:
+                    data = task.result()
+                except Exception as e:
+                    logger.warning(f"Model {model_name} failed: {e}")
+                    last_error = e
+                    if queue:
+                        launch()
+                    continue
+                logger.info(f"Success with model: {model_name}")
+                return data
+    finally:
+        for task in running:
+            task.cancel()
+        if running:
+            await asyncio.gather(*running, return_exceptions=True)
+    raise last_error
+
 async def analyze_clothing_photo(photo_bytes: bytes) -> Dict:
     """
     Analyze clothing photo using Gemini Vision (V1)
@@ -33,11 +115,9 @@ async def analyze_clothing_photo(photo_bytes: bytes) -> Dict:
     if not client:
         return {'success': False, 'error': "AI client not initialized"}
 
-    import PIL.Image
-    
     # Prepare image
     try:
-        image = PIL.Image.open(BytesIO(photo_bytes))
+        image = await asyncio.to_thread(_load_image, photo_bytes)
     except Exception as e:
         return {'success': False, 'error': f"Image load error: {e}"}
 
@@ -69,40 +149,14 @@ async def analyze_clothing_photo(photo_bytes: bytes) -> Dict:
         'gemini-1.5-flash',
     ]
 
-    last_error = None
-    
-    for model_name in candidates:
-        try:
-            logger.info(f"Attempting analysis with model: {model_name}")
-
-            # Call API
-            response = client.models.generate_content(
-                model=model_name,
-                contents=[image, prompt_text],
-                config=types.GenerateContentConfig(
-                    response_mime_type="application/json"
-                )
-            )
-            
-            # Check response
-            if not response.text:
-                raise ValueError("Empty response from AI")
-
-            data = json.loads(response.text)
-            data['success'] = True
-            logger.info(f"Success with model: {model_name}")
-            return data
-            
-        except Exception as e:
-            logger.warning(f"Model {model_name} failed: {e}")
-            last_error = e
-            continue
-    
-    logger.error("All Gemini models failed")
-    return {
-        'success': False,
-        'error': f"AI Analysis failed. Last error: {str(last_error)}"
-    }
+    try:
+        return await _hedged_generate(candidates, [image, prompt_text], "analysis")
+    except Exception as e:
+        logger.error("All Gemini models failed")
+        return {
+            'success': False,
+            'error': f"AI Analysis failed. Last error: {str(e)}"
+        }
 
 async def analyze_clothing_text(text_description: str) -> Dict:
     """
@@ -137,34 +191,10 @@ async def analyze_clothing_text(text_description: str) -> Dict:
         'gemini-2.0-flash',
         'gemini-1.5-flash',
     ]
-    last_error = None
-    
-    for model_name in candidates:
-        try:
-            logger.info(f"Attempting text analysis with model: {model_name}")
-            
-            response = client.models.generate_content(
-                model=model_name,
-                contents=prompt,
-                config=types.GenerateContentConfig(
-                    response_mime_type="application/json"
-                )
-            )
-            
-            if not response.text:
-                raise ValueError("Empty response")
-            
-            data = json.loads(response.text)
-            data['success'] = True
-            logger.info(f"Success with model: {model_name}")
-            return data
-            
-        except Exception as e:
-            logger.warning(f"Model {model_name} failed: {e}")
-            last_error = e
-            continue
-            
-    return {'success': False, 'error': f"Analysis failed: {str(last_error)}"}
+    try:
+        return await _hedged_generate(candidates, prompt, "text analysis")
+    except Exception as e:
+        return {'success': False, 'error': f"Analysis failed: {str(e)}"}
 
 def generate_clothing_recommendation(clothing_data: Dict, weather_data: Dict, user_name: str) -> str:
     """
@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+"""
+Микро-бенчмарк чтения: ORM-гидратация + словарь по __table__.columns
+(старый путь) против Core select(...).mappings() (текущий database/__init__.py).
+
+    python benchmark_row_mapping.py --rows 100000
+"""
+import os
+import sys
+import time
+import asyncio
+import logging
+import argparse
+import tempfile
+from sqlalchemy import select, insert
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
+
+logging.basicConfig(level=logging.INFO, format='%(message)s')
+logger = logging.getLogger(__name__)
+
+async def read_orm(Session):
+    """Старый путь: select(User) → ORM-объекты → dict по колонкам."""
+    from database.models import User
+    async with Session() as session:
+        result = await session.execute(select(User).where(User.is_active == True))
+        return [{c.name: getattr(u, c.name) for c in u.__table__.columns} for u in result.scalars().all()]
+
+async def read_core(Session):
+    """Новый путь: select(колонки таблицы) → mappings() → dict."""
+    from database.models import User
+    async with Session() as session:
+        result = await session.execute(select(User.__table__.c).where(User.is_active == True))
+        return [dict(row) for row in result.mappings()]
+
+async def run(url: str, rows: int, repeats: int):
+    from database.models import Base, User
+
+    engine = create_async_engine(url)
+    Session = async_sessionmaker(engine, expire_on_commit=False, class_=AsyncSession)
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all, tables=[User.__table__])
+        await conn.execute(insert(User), [
+            {'user_id': i, 'username': f"user{i}", 'user_name': f"Имя {i}", 'notification_time': "07:00",
+             'timezone': "Europe/Moscow", 'is_active': True}
+            for i in range(1, rows + 1)
+        ])
+
+    logger.info("=" * 60)
+    logger.info(f"📈 ЧТЕНИЕ {rows} СТРОК users ({engine.dialect.name}, лучший из {repeats})")
+    logger.info("=" * 60)
+
+    timings = {}
+    for label, reader in (("ORM + __table__.columns", read_orm), ("Core .mappings()", read_core)):
+        best = float('inf')
+        for _ in range(repeats):
+            started = time.perf_counter()
+            users = await reader(Session)
+            best = min(best, time.perf_counter() - started)
+        assert len(users) == rows
+        timings[label] = best
+        logger.info(f"  {label:<26} {best:8.3f} с   {rows / best:12,.0f} строк/с")
+
+    orm, core = timings.values()
+    logger.info("=" * 60)
+    logger.info(f"🚀 Core .mappings() быстрее в {orm / core:.1f} раз")
+    await engine.dispose()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=100_000)
+    parser.add_argument("--repeats", type=int, default=3)
+    args = parser.parse_args()
+
+    # Всегда временная база: бенчмарк сам заполняет таблицу users
+    with tempfile.TemporaryDirectory() as tmp:
+        asyncio.run(run(f"sqlite+aiosqlite:///{os.path.join(tmp, 'bench.db')}", args.rows, args.repeats))
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+"""
+Скрипт для проверки движка умных уведомлений без базы и WeatherAPI.
+Проверяет индекс подписок по локациям и состояние утренних когорт.
+"""
+import sys
+import asyncio
+import logging
+from types import SimpleNamespace
+
+logging.basicConfig(level=logging.INFO, format='%(message)s')
+logger = logging.getLogger(__name__)
+
+def _user(user_id, lat=55.76, lon=37.62, timezone='Europe/Moscow', **prefs):
+    return {'user_id': user_id, 'user_name': f"user{user_id}", 'timezone': timezone, 'is_active': True,
+            'alerts_enabled': prefs.pop('alerts_enabled', True),
+            'city': {'latitude': lat, 'longitude': lon}, 'preferences': prefs}
+
+def _no_flags(user_id, **kwargs):
+    flags = {flag: False for flag in ('rain_alerts', 'uv_alerts', 'air_quality_alerts',
+                                      'severe_weather_alerts', 'temp_change_alerts', 'alerts_enabled')}
+    return _user(user_id, **kwargs, **flags)
+
+def check_subscription_index() -> bool:
+    """Локация остаётся в индексе, пока в ней есть пользователи, даже без включённых флагов."""
+    from core.geo import location_key
+    from services.alert_subscriptions import AlertSubscriptionIndex
+
+    index = AlertSubscriptionIndex()
+    key = location_key(55.76, 37.62)
+    index.load([_user(1, uv_alerts=True), _no_flags(2), _no_flags(3)])
+
+    # Последний подписчик уходит, пользователи без флагов остаются
+    index.remove(1)
+    assert [loc['key'] for loc in index.locations()] == [key]
+    assert [loc['key'] for loc in index.locations('Europe/Moscow')] == [key]
+    assert index.subscribers(key, ('uv_alerts',)) == []
+
+    index.set_flag(2, 'uv_alerts', True)
+    assert index.subscribers(key, ('uv_alerts',)) == [(2, 'user2')]
+    index.set_flag(2, 'uv_alerts', False)
+
+    index.index_user(_no_flags(3))  # повторная индексация снимает старую запись
+    index.remove(2)
+    index.remove(3)
+    assert index.locations() == [] and index.timezones() == [] and len(index) == 0
+
+    # Повторная индексация после полного удаления локации
+    index.index_user(_user(2, uv_alerts=True))
+    assert index.subscribers(key, ('uv_alerts',)) == [(2, 'user2')]
+    logger.info("✅ Индекс подписок: локации без подписчиков не теряются")
+    return True
+
+def _memory_alert_states():
+    """AlertStateStore без базы: load/save ничего не делают."""
+    from services.alert_state import AlertStateStore
+
+    store = AlertStateStore()
+    store._loaded = True
+
+    async def save():
+        store._dirty = {}
+    store.save = save
+    return store
+
+async def _check_morning_cohorts():
+    import smart_alerts
+    from config import ALERT_UV_THRESHOLD
+    from services.alert_subscriptions import AlertSubscriptionIndex
+
+    index = AlertSubscriptionIndex()
+    index.load([_user(1, timezone='Europe/Moscow', uv_alerts=True), _user(2, timezone='Asia/Dubai', uv_alerts=True)])
+    sent = []
+
+    async def fake_bundle(lat, lon):
+        return SimpleNamespace(uv_index=ALERT_UV_THRESHOLD + 2, location={'localtime': '2026-07-01 07:00'})
+
+    patched = {
+        'alert_subscriptions': index,
+        'alert_states': _memory_alert_states(),
+        'get_weather_bundle': fake_bundle,
+        'delivery_queue': SimpleNamespace(submit=lambda user_id, text, **kwargs: sent.append(user_id)),
+    }
+    saved = {name: getattr(smart_alerts, name) for name in patched}
+    for name, value in patched.items():
+        setattr(smart_alerts, name, value)
+    try:
+        await smart_alerts.run_alert_cycle(smart_alerts.MORNING_ALERT_TYPES, 'Europe/Moscow')
+        await smart_alerts.run_alert_cycle(smart_alerts.MORNING_ALERT_TYPES, 'Asia/Dubai')
+        # Повторный запуск той же когорты в тот же день подавляется
+        await smart_alerts.run_alert_cycle(smart_alerts.MORNING_ALERT_TYPES, 'Europe/Moscow')
+    finally:
+        for name, value in saved.items():
+            setattr(smart_alerts, name, value)
+    return sent
+
+def check_morning_cohorts() -> bool:
+    """Две когорты в одной локации получают УФ-уведомление независимо друг от друга."""
+    sent = asyncio.run(_check_morning_cohorts())
+    assert sent == [1, 2], sent
+    logger.info("✅ Утренние когорты: у каждой свой cooldown и de-dup")
+    return True
+
+def main() -> bool:
+    logger.info("=" * 60)
+    logger.info("🔍 ПРОВЕРКА УМНЫХ УВЕДОМЛЕНИЙ")
+    logger.info("=" * 60)
+
+    all_ok = True
+    for check in (check_subscription_index, check_morning_cohorts):
+        try:
+            check()
+        except AssertionError as e:
+            all_ok = False
+            logger.error(f"❌ {check.__doc__} {e}", exc_info=True)
+
+    logger.info("=" * 60)
+    if all_ok:
+        logger.info("🎉 Все проверки пройдены.")
+    else:
+        logger.error("⚠️ Есть ошибки.")
+    return all_ok
+
+if __name__ == "__main__":
+    sys.exit(0 if main() else 1)
@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+"""
+Скрипт для проверки планов горячих запросов.
+Выполняет EXPLAIN (SQLite: EXPLAIN QUERY PLAN, PostgreSQL: EXPLAIN)
+и проверяет, что каждый запрос использует свой индекс.
+"""
+import sys
+import asyncio
+import logging
+import datetime
+from sqlalchemy import select, delete, desc, text, tuple_
+
+logging.basicConfig(level=logging.INFO, format='%(message)s')
+logger = logging.getLogger(__name__)
+
+def build_hot_queries():
+    """(название, запрос, допустимые индексы) для каждого горячего пути."""
+    from database import _primary_city_id, hour_bucket
+    from database.models import User, City, LocationHistory, HourlyObservation
+
+    now = datetime.datetime.now(datetime.timezone.utc)
+    target = now - datetime.timedelta(hours=24)
+
+    return [
+        (
+            "get_user_cities",
+            select(City).where(City.user_id == 1).order_by(desc(City.is_primary), City.id),
+            ["ix_cities_user_primary"],
+        ),
+        (
+            "get_primary_city",
+            select(City).join(User, City.id == _primary_city_id()).where(User.user_id == 1),
+            ["ix_cities_user_primary"],
+        ),
+        (
+            "iter_active_users_with_city (primary city subquery)",
+            select(User, City).outerjoin(City, City.id == _primary_city_id()).where(User.is_active == True).limit(1000),
+            ["ix_cities_user_primary"],
+        ),
+        (
+            "get_all_active_users",
+            select(User).where(User.is_active == True),
+            ["ix_users_active_notification_time"],
+        ),
+        (
+            "get_weather_comparison",
+            select(HourlyObservation)
+            .where(HourlyObservation.location_key == "55.76,37.62")
+            .where(HourlyObservation.hour_bucket.between(hour_bucket(target) - 1, hour_bucket(target) + 1)),
+            # SQLite WITHOUT ROWID таблица читается прямо по первичному ключу
+            ["PRIMARY KEY", "pk_hourly_observations"],
+        ),
+        (
+            "hourly_observations retention",
+            delete(HourlyObservation).where(tuple_(HourlyObservation.location_key, HourlyObservation.hour_bucket).in_(
+                select(HourlyObservation.location_key, HourlyObservation.hour_bucket)
+                .where(HourlyObservation.hour_bucket < hour_bucket(now - datetime.timedelta(hours=48))).limit(1000)
+            )),
+            ["ix_hourly_observations_hour_bucket"],
+        ),
+        (
+            "location_history retention",
+            delete(LocationHistory).where(LocationHistory.id.in_(
+                select(LocationHistory.id).where(LocationHistory.date < now.date() - datetime.timedelta(days=365)).limit(1000)
+            )),
+            ["ix_location_history_date"],
+        ),
+        (
+            "get_weekly_stats",
+            select(LocationHistory)
+            .where(LocationHistory.location_id == 1)
+            .order_by(desc(LocationHistory.date))
+            .limit(7),
+            ["_location_date_uc", "sqlite_autoindex_location_history_1"],
+        ),
+    ]
+
+async def explain(conn, stmt, is_postgres: bool) -> str:
+    compiled = stmt.compile(dialect=conn.dialect, compile_kwargs={"literal_binds": True})
+    prefix = "EXPLAIN" if is_postgres else "EXPLAIN QUERY PLAN"
+    result = await conn.execute(text(f"{prefix} {compiled}"))
+    # SQLite: (id, parent, notused, detail); PostgreSQL: (QUERY PLAN,)
+    return "\n".join(str(row[-1]) for row in result.fetchall())
+
+async def check_plans() -> bool:
+    from database.session import engine
+
+    is_postgres = engine.dialect.name == "postgresql"
+    logger.info("=" * 60)
+    logger.info(f"🔍 ПРОВЕРКА ПЛАНОВ ЗАПРОСОВ ({engine.dialect.name})")
+    logger.info("=" * 60)
+
+    all_ok = True
+    async with engine.connect() as conn:
+        if is_postgres:
+            # На маленьких таблицах планировщик предпочитает seq scan — запрещаем его,
+            # чтобы проверить, что индекс вообще применим
+            await conn.execute(text("SET enable_seqscan = off"))
+
+        for name, stmt, indexes in build_hot_queries():
+            plan = await explain(conn, stmt, is_postgres)
+            used = next((ix for ix in indexes if ix in plan), None)
+            if used:
+                logger.info(f"✅ {name}: {used}")
+            else:
+                all_ok = False
+                logger.error(f"❌ {name}: индекс не используется ({', '.join(indexes)})")
+                for line in plan.splitlines():
+                    logger.error(f"     {line}")
+
+        await conn.rollback()
+
+    logger.info("=" * 60)
+    if all_ok:
+        logger.info("🎉 Все горячие запросы используют индексы.")
+    else:
+        logger.error("⚠️ Есть запросы без индекса. Примените миграции: alembic upgrade head")
+    return all_ok
+
+if __name__ == "__main__":
+    sys.exit(0 if asyncio.run(check_plans()) else 1)
@@ -34,9 +34,101 @@ if not DATABASE_PATH.startswith("postgres"):
         if db_dir and not os.path.exists(db_dir):
             os.makedirs(db_dir, exist_ok=True)
 
+# Optional read replica for read-only scans (same URL formats as DATABASE_URL)
+READ_REPLICA_URL = (os.getenv("READ_REPLICA_URL") or "").strip() or None
+READ_REPLICA_RETRY_AFTER = int(os.getenv("READ_REPLICA_RETRY_AFTER", "30"))  # seconds on primary after a replica failure
+
+# Database engine profile
+# PostgreSQL (asyncpg) connection pool
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = int(os.getenv("DB_POOL_TIMEOUT", "30"))  # seconds to wait for a free connection
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))  # seconds; below Railway's idle cutoff
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() in ("1", "true", "yes")
+DB_STATEMENT_CACHE_SIZE = int(os.getenv("DB_STATEMENT_CACHE_SIZE", "100"))  # 0 behind PgBouncer (transaction mode)
+# SQLite PRAGMAs applied to every new connection
+SQLITE_JOURNAL_MODE = os.getenv("SQLITE_JOURNAL_MODE", "WAL")
+SQLITE_SYNCHRONOUS = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL")
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+SQLITE_CACHE_SIZE_KB = int(os.getenv("SQLITE_CACHE_SIZE_KB", "20000"))
+SQLITE_MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))  # bytes, 0 disables
+
 LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
 ADMIN_ID = os.getenv("ADMIN_ID") # Add this to .env to see bot stats
 
+# WeatherAPI HTTP connection pool
+WEATHERAPI_POOL_LIMIT = int(os.getenv("WEATHERAPI_POOL_LIMIT", "100"))
+WEATHERAPI_POOL_LIMIT_PER_HOST = int(os.getenv("WEATHERAPI_POOL_LIMIT_PER_HOST", "20"))
+WEATHERAPI_DNS_CACHE_TTL = int(os.getenv("WEATHERAPI_DNS_CACHE_TTL", "300"))  # seconds
+WEATHERAPI_KEEPALIVE_TIMEOUT = int(os.getenv("WEATHERAPI_KEEPALIVE_TIMEOUT", "60"))  # seconds
+
+# Daily notification fan-out: worker pool size and the limit on upstream
+# weather fetches (sends are paced by the delivery queue)
+NOTIFICATION_WORKERS = int(os.getenv("NOTIFICATION_WORKERS", "32"))
+NOTIFICATION_WEATHER_CONCURRENCY = int(os.getenv("NOTIFICATION_WEATHER_CONCURRENCY", "10"))
+
+# Nightly history job: concurrent location fetches, rows per bulk upsert
+HISTORY_WORKERS = int(os.getenv("HISTORY_WORKERS", "10"))
+HISTORY_WRITE_BATCH_SIZE = int(os.getenv("HISTORY_WRITE_BATCH_SIZE", "500"))
+
+# Outbound Telegram delivery (limits: ~30 msg/s overall, ~1 msg/s per chat).
+# The queue's rate is kept below the limit: handler replies bypass it.
+TELEGRAM_GLOBAL_RATE = float(os.getenv("TELEGRAM_GLOBAL_RATE", "25"))
+TELEGRAM_PER_CHAT_INTERVAL = float(os.getenv("TELEGRAM_PER_CHAT_INTERVAL", "1.0"))  # seconds
+TELEGRAM_DELIVERY_WORKERS = int(os.getenv("TELEGRAM_DELIVERY_WORKERS", "8"))
+TELEGRAM_DELIVERY_MAX_RETRIES = int(os.getenv("TELEGRAM_DELIVERY_MAX_RETRIES", "3"))
+
+# Data retention, enforced by the background pruning job (0 keeps rows forever)
+HOURLY_OBSERVATION_RETENTION_HOURS = int(os.getenv("HOURLY_OBSERVATION_RETENTION_HOURS", "48"))
+# Daily history feeds the weekly stats; kept forever unless a window is set
+WEATHER_HISTORY_RETENTION_DAYS = int(os.getenv("WEATHER_HISTORY_RETENTION_DAYS", "0"))
+PRUNE_BATCH_SIZE = int(os.getenv("PRUNE_BATCH_SIZE", "1000"))
+PRUNE_INTERVAL = int(os.getenv("PRUNE_INTERVAL", "3600"))  # seconds
+
+# Write-behind buffer for per-view writes (observations, streaks, last_notification)
+WRITE_BEHIND_FLUSH_INTERVAL_MS = int(os.getenv("WRITE_BEHIND_FLUSH_INTERVAL_MS", "500"))
+WRITE_BEHIND_MAX_BATCH = int(os.getenv("WRITE_BEHIND_MAX_BATCH", "500"))  # flush early at this many records
+WRITE_BEHIND_MAX_PENDING = int(os.getenv("WRITE_BEHIND_MAX_PENDING", "10000"))  # writers wait for a flush beyond this
+
+# Smart alerts: one bundle per distinct location per cycle, rules evaluated in one pass
+ALERT_WORKERS = int(os.getenv("ALERT_WORKERS", "10"))  # concurrent location fetches
+ALERT_RAIN_WINDOW_HOURS = int(os.getenv("ALERT_RAIN_WINDOW_HOURS", "2"))
+ALERT_UV_THRESHOLD = int(os.getenv("ALERT_UV_THRESHOLD", "6"))
+ALERT_AQI_THRESHOLD = int(os.getenv("ALERT_AQI_THRESHOLD", "100"))
+ALERT_TEMP_SWING = float(os.getenv("ALERT_TEMP_SWING", "10"))  # °C between min and max of the day's forecast
+ALERT_MORNING_TIME = os.getenv("ALERT_MORNING_TIME", "07:00")  # users' local time for UV (morning) alerts
+
+# Alert state: per-type cooldowns (seconds between two firings at one scope, whatever
+# the occurrence) and hysteresis margins (an active condition re-arms only once its
+# value drops below threshold - margin). The same occurrence never fires twice while
+# its state row is kept (ALERT_STATE_RETENTION_HOURS).
+ALERT_COOLDOWNS = {
+    'rain': int(os.getenv("ALERT_COOLDOWN_RAIN", str(6 * 3600))),
+    'uv': int(os.getenv("ALERT_COOLDOWN_UV", str(20 * 3600))),
+    'air_quality': int(os.getenv("ALERT_COOLDOWN_AIR_QUALITY", str(12 * 3600))),
+    'severe': int(os.getenv("ALERT_COOLDOWN_SEVERE", "0")),
+    'temp_change': int(os.getenv("ALERT_COOLDOWN_TEMP_CHANGE", str(20 * 3600))),
+}
+ALERT_HYSTERESIS = {
+    'air_quality': float(os.getenv("ALERT_HYSTERESIS_AIR_QUALITY", "20")),
+}
+ALERT_STATE_RETENTION_HOURS = int(os.getenv("ALERT_STATE_RETENTION_HOURS", "48"))
+
+# Gemini clothing analysis: per-model timeout, and how long to wait before
+# hedging with the next candidate model while the previous one is still running
+GEMINI_MODEL_TIMEOUT = float(os.getenv("GEMINI_MODEL_TIMEOUT", "20"))  # seconds
+GEMINI_HEDGE_DELAY = float(os.getenv("GEMINI_HEDGE_DELAY", "5"))  # seconds
+
+# Shared weather cache (keyed by rounded coordinates, ~1 km at 2 decimals)
+COORD_PRECISION = int(os.getenv("COORD_PRECISION", "2"))
+WEATHER_CACHE_MAX_ENTRIES = int(os.getenv("WEATHER_CACHE_MAX_ENTRIES", "5000"))
+# TTL in seconds per data kind. The bundle carries current conditions,
+# hourly forecast, AQI and alerts, so its TTL is bounded by the freshest of them.
+WEATHER_CACHE_TTLS = {
+    'bundle': int(os.getenv("WEATHER_CACHE_TTL_BUNDLE", "600")),
+    'coordinates': int(os.getenv("WEATHER_CACHE_TTL_COORDINATES", "86400")),
+}
+
 logger = logging.getLogger(__name__)
 
 # Validate critical API keys
@@ -1,8 +1,16 @@
-from telegram.ext import ApplicationBuilder
+from telegram.ext import Application, ApplicationBuilder
 from config import TELEGRAM_BOT_TOKEN
+from database import unit_of_work
+
+class UnitOfWorkApplication(Application):
+    """Runs each update inside one database unit of work (shared session, single commit)."""
+
+    async def process_update(self, update: object) -> None:
+        async with unit_of_work():
+            await super().process_update(update)
 
 def create_application():
     if not TELEGRAM_BOT_TOKEN:
         raise ValueError("TELEGRAM_BOT_TOKEN is not set in config")
         
-    return ApplicationBuilder().token(TELEGRAM_BOT_TOKEN).build()
+    return ApplicationBuilder().token(TELEGRAM_BOT_TOKEN).application_class(UnitOfWorkApplication).build()
@@ -0,0 +1,10 @@
+from config import COORD_PRECISION
+
+def round_coordinates(lat: float, lon: float, precision: int = COORD_PRECISION):
+    """Rounds coordinates so nearby points (same city district) share one key."""
+    return round(float(lat), precision), round(float(lon), precision)
+
+def location_key(lat: float, lon: float, precision: int = COORD_PRECISION) -> str:
+    """Stable string key for a location, e.g. '55.76,37.62'."""
+    r_lat, r_lon = round_coordinates(lat, lon, precision)
+    return f"{r_lat:.{precision}f},{r_lon:.{precision}f}"
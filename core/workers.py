@@ -0,0 +1,30 @@
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Iterable, List, Tuple
+
+logger = logging.getLogger(__name__)
+
+async def run_worker_pool(items: Iterable[Any], handler: Callable[[Any], Awaitable[Any]], workers: int) -> List[Tuple[Any, Any]]:
+    """
+    Processes items with at most `workers` handlers running concurrently.
+    Failures are isolated per item: returns [(item, result_or_exception)] in input order.
+    """
+    items = list(items)
+    results: List[Any] = [None] * len(items)
+    queue: asyncio.Queue = asyncio.Queue()
+    for idx, item in enumerate(items):
+        queue.put_nowait((idx, item))
+
+    async def worker():
+        while True:
+            try:
+                idx, item = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            try:
+                results[idx] = await handler(item)
+            except Exception as e:
+                results[idx] = e
+
+    await asyncio.gather(*(worker() for _ in range(max(1, min(workers, len(items))))))
+    return list(zip(items, results))
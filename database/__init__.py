@@ -1,23 +1,60 @@
+import asyncio
 import logging
 import datetime
-from contextlib import asynccontextmanager
-from sqlalchemy import select, update, delete, desc, func
-from .session import AsyncSessionLocal
-from .models import User, City, WeatherHistory, NotificationPreference, WeatherSnapshot, WardrobeItem
-from config import DATABASE_PATH
+import functools
+from sqlalchemy import select, update, delete, desc, func, tuple_, or_, bindparam
+from .session import (
+    AsyncSessionLocal, session_scope, unit_of_work, commit_unit_of_work, run_read,
+    get_unit_of_work_stats, get_pool_stats, get_read_routing_stats
+)
+from .upsert import bulk_upsert
+from .models import (
+    User, City, Location, LocationHistory, NotificationPreference, WardrobeItem, HourlyObservation,
+    AlertState
+)
+from core.geo import location_key, round_coordinates
+from config import (
+    WEATHER_HISTORY_RETENTION_DAYS,
+    HOURLY_OBSERVATION_RETENTION_HOURS, ALERT_STATE_RETENTION_HOURS, PRUNE_BATCH_SIZE
+)
 
 logger = logging.getLogger(__name__)
 
-@asynccontextmanager
-async def get_session():
-    """Get database session for queries"""
-    async with AsyncSessionLocal() as session:
-        try:
-            yield session
-            await session.commit()
-        except Exception:
-            await session.rollback()
-            raise
+# Read paths select table columns with Core and return plain dicts from
+# result.mappings(), skipping ORM identity-map hydration. Writes that need
+# object state (cascades, relationship fix-ups) still go through the ORM.
+
+def _cols(model):
+    return model.__table__.c
+
+async def _fetch_all(session, stmt) -> list:
+    return [dict(row) for row in (await session.execute(stmt)).mappings()]
+
+async def _fetch_rows(session, stmt) -> list:
+    return (await session.execute(stmt)).all()
+
+async def _fetch_one(session, stmt):
+    row = (await session.execute(stmt)).mappings().first()
+    return dict(row) if row is not None else None
+
+@functools.lru_cache(maxsize=None)
+def _layout(model):
+    return [c.name for c in _cols(model)], [c.name for c in model.__table__.primary_key.columns]
+
+def _split_row(row, *models) -> list:
+    """Splits a flat row selected as select(*_cols(A), *_cols(B), ...) into one dict per model.
+    An outer-joined model with a NULL primary key becomes None."""
+    parts, offset = [], 0
+    for model in models:
+        names, pk = _layout(model)
+        part = dict(zip(names, row[offset:offset + len(names)]))
+        offset += len(names)
+        parts.append(None if all(part[name] is None for name in pk) else part)
+    return parts
+
+# Data-access functions run in session_scope(): inside a Telegram update they share
+# the update's unit-of-work session, elsewhere (jobs, scripts) each call gets its own.
+get_session = session_scope
 
 async def init_db():
     """Initializes the database and performs migrations."""
@@ -30,7 +67,7 @@ async def init_db():
     logger.info("🗄 База данных инициализирована (таблицы проверены/созданы)")
 
 async def upsert_user(user_id: int, username: str, user_name: str = "друг", timezone: str = 'Europe/Moscow'):
-    async with AsyncSessionLocal() as session:
+    async with session_scope() as session:
         result = await session.execute(select(User).where(User.user_id == user_id))
         user = result.scalar_one_or_none()
         
@@ -49,39 +86,136 @@ async def upsert_user(user_id: int, username: str, user_name: str = "друг",
             session.add(user)
             prefs = NotificationPreference(user_id=user_id)
             session.add(prefs)
-        await session.commit()
 
 async def update_user_field(user_id: int, field: str, value):
-    async with AsyncSessionLocal() as session:
+    async with session_scope() as session:
         await session.execute(update(User).where(User.user_id == user_id).values({field: value}))
-        await session.commit()
 
 async def get_user(user_id: int):
-    async with AsyncSessionLocal() as session:
-        result = await session.execute(select(User).where(User.user_id == user_id))
-        user = result.scalar_one_or_none()
-        if user:
-            return {c.name: getattr(user, c.name) for c in user.__table__.columns}
-        return None
+    async with session_scope(write=False) as session:
+        return await _fetch_one(session, select(_cols(User)).where(User.user_id == user_id))
 
 async def get_all_active_users():
-    async with AsyncSessionLocal() as session:
-        result = await session.execute(select(User).where(User.is_active == True))
-        users = result.scalars().all()
-        return [{c.name: getattr(u, c.name) for c in u.__table__.columns} for u in users]
+    return await run_read(lambda session: _fetch_all(session, select(_cols(User)).where(User.is_active == True)))
+
+def _primary_city_id():
+    """Correlated subquery picking a user's primary city (or their first one)."""
+    return (
+        select(City.id)
+        .where(City.user_id == User.user_id)
+        .order_by(desc(City.is_primary), City.id)
+        .limit(1)
+        .correlate(User)
+        .scalar_subquery()
+    )
+
+async def iter_active_users_with_city(batch_size: int = 1000, with_preferences: bool = False, user_ids: list = None):
+    """
+    Yields pages of active users joined with their primary city in one query per page.
+    Each user dict gets a 'city' key (dict or None) and, with with_preferences=True,
+    a 'preferences' key (dict, or None if the user has no preferences row yet).
+    Pages are keyset-paginated on user_id, so memory stays flat for any number of users.
+    """
+    models = [User, City] + ([NotificationPreference] if with_preferences else [])
+    columns = [col for model in models for col in _cols(model)]
+    last_id = None
+    while True:
+        stmt = (
+            select(*columns)
+            .outerjoin(City, City.id == _primary_city_id())
+            .where(User.is_active == True)
+            .order_by(User.user_id)
+            .limit(batch_size)
+        )
+        if with_preferences:
+            stmt = stmt.outerjoin(NotificationPreference, NotificationPreference.user_id == User.user_id)
+        if user_ids is not None:
+            stmt = stmt.where(User.user_id.in_(user_ids))
+        if last_id is not None:
+            stmt = stmt.where(User.user_id > last_id)
+
+        rows = await run_read(lambda session: _fetch_rows(session, stmt))
+
+        page = []
+        for row in rows:
+            parts = _split_row(row, *models)
+            user = parts[0]
+            user['city'] = parts[1]
+            if with_preferences:
+                user['preferences'] = parts[2]
+            page.append(user)
+        if page:
+            yield page
+        if len(rows) < batch_size:
+            return
+        last_id = page[-1]['user_id']
+
+async def get_active_users_with_city(user_ids: list, with_preferences: bool = False):
+    """Loads the given active users with their primary city, one query per 500 ids."""
+    users = []
+    ids = list(user_ids)
+    for i in range(0, len(ids), 500):
+        async for page in iter_active_users_with_city(batch_size=500, with_preferences=with_preferences, user_ids=ids[i:i + 500]):
+            users.extend(page)
+    return users
 
 async def update_last_notification(user_id: int):
-    async with AsyncSessionLocal() as session:
+    async with session_scope() as session:
         await session.execute(update(User).where(User.user_id == user_id).values(last_notification=func.now()))
-        await session.commit()
+
+async def set_last_notifications(rows: list) -> int:
+    """Bulk form for the write-behind buffer: [{'user_id', 'last_notification'}]."""
+    if not rows:
+        return 0
+    users = User.__table__
+    stmt = (
+        update(users)
+        .where(users.c.user_id == bindparam('b_user_id'))
+        .values(last_notification=bindparam('b_last_notification'))
+    )
+    async with session_scope() as session:
+        await session.execute(stmt, [{'b_user_id': r['user_id'], 'b_last_notification': r['last_notification']} for r in rows])
+    return len(rows)
+
+async def apply_streak_updates(rows: list) -> int:
+    """
+    Bulk streak writes for the write-behind buffer: [{'user_id', 'last_check_date',
+    'current_streak', 'best_streak'}]. A row only applies over an older check date,
+    so a late or repeated flush can never move a streak backwards.
+    """
+    if not rows:
+        return 0
+    users = User.__table__
+    stmt = (
+        update(users)
+        .where(users.c.user_id == bindparam('b_user_id'))
+        .where(or_(users.c.last_check_date.is_(None), users.c.last_check_date < bindparam('b_last_check_date')))
+        .values(
+            last_check_date=bindparam('b_last_check_date'),
+            current_streak=bindparam('b_current_streak'),
+            best_streak=bindparam('b_best_streak'),
+        )
+    )
+    async with session_scope() as session:
+        await session.execute(stmt, [{f"b_{k}": v for k, v in r.items()} for r in rows])
+    return len(rows)
 
 async def update_user_timezone(user_id: int, timezone: str):
-    async with AsyncSessionLocal() as session:
+    async with session_scope() as session:
         await session.execute(update(User).where(User.user_id == user_id).values(timezone=timezone, timezone_initialized=1))
-        await session.commit()
+
+async def _get_or_create_location(session, lat: float, lon: float, name: str) -> int:
+    """Returns the id of the location the coordinates round to, creating it on first use."""
+    key = location_key(lat, lon)
+    r_lat, r_lon = round_coordinates(lat, lon)
+    # ON CONFLICT DO NOTHING: two users adding the same city at once must not race
+    await bulk_upsert(session, Location, [dict(key=key, name=name, latitude=r_lat, longitude=r_lon)],
+                      index_elements=['key'], update_columns=())
+    return (await session.execute(select(Location.id).where(Location.key == key))).scalar_one()
 
 async def add_city(user_id: int, city_name: str, lat: float, lon: float, is_primary: bool = False):
-    async with AsyncSessionLocal() as session:
+    async with session_scope() as session:
+        location_id = await _get_or_create_location(session, lat, lon, city_name)
         if is_primary:
             await session.execute(update(City).where(City.user_id == user_id).values(is_primary=False))
         
@@ -90,29 +224,25 @@ async def add_city(user_id: int, city_name: str, lat: float, lon: float, is_prim
         if count == 0:
             is_primary = True
 
-        new_city = City(user_id=user_id, city_name=city_name, latitude=lat, longitude=lon, is_primary=is_primary)
+        new_city = City(user_id=user_id, city_name=city_name, latitude=lat, longitude=lon,
+                        is_primary=is_primary, location_id=location_id)
         session.add(new_city)
-        await session.commit()
 
 async def get_user_cities(user_id: int):
-    async with AsyncSessionLocal() as session:
-        result = await session.execute(
-            select(City)
-            .where(City.user_id == user_id)
-            .order_by(desc(City.is_primary), City.id)
-        )
-        cities = result.scalars().all()
-        return [{c.name: getattr(city, c.name) for c in city.__table__.columns} for city in cities]
+    stmt = (
+        select(_cols(City))
+        .where(City.user_id == user_id)
+        .order_by(desc(City.is_primary), City.id)
+    )
+    return await run_read(lambda session: _fetch_all(session, stmt))
 
 async def get_primary_city(user_id: int):
-    cities = await get_user_cities(user_id)
-    for c in cities:
-        if c['is_primary']:
-            return c
-    return cities[0] if cities else None
+    """The user's primary city (or their first one), found by the same indexed subquery as the batch reads."""
+    stmt = select(_cols(City)).join(User, City.id == _primary_city_id()).where(User.user_id == user_id)
+    return await run_read(lambda session: _fetch_one(session, stmt))
 
 async def remove_city(user_id: int, city_id: int):
-    async with AsyncSessionLocal() as session:
+    async with session_scope() as session:
         await session.execute(delete(City).where(City.id == city_id, City.user_id == user_id))
         # Check remaining cities and ensure one is primary
         result = await session.execute(
@@ -123,98 +253,164 @@ async def remove_city(user_id: int, city_id: int):
         remaining_cities = result.scalars().all()
         if remaining_cities and not any(c.is_primary for c in remaining_cities):
             remaining_cities[0].is_primary = True
-        await session.commit()
 
 async def set_primary_city(user_id: int, city_id: int):
-    async with AsyncSessionLocal() as session:
+    async with session_scope() as session:
         await session.execute(update(City).where(City.user_id == user_id).values(is_primary=False))
         await session.execute(update(City).where(City.id == city_id, City.user_id == user_id).values(is_primary=True))
-        await session.commit()
 
-async def save_weather_history(user_id: int, city_name: str, date: str, data: dict):
-    async with AsyncSessionLocal() as session:
-        date_obj = datetime.datetime.strptime(date, "%Y-%m-%d").date()
-        result = await session.execute(
-            select(WeatherHistory)
-            .where(WeatherHistory.user_id == user_id, WeatherHistory.city_name == city_name, WeatherHistory.date == date_obj)
-        )
-        hist = result.scalar_one_or_none()
-        
-        if hist:
-            hist.temp_avg = data['temp_avg']
-            hist.temp_min = data['temp_min']
-            hist.temp_max = data['temp_max']
-            hist.condition = data['condition']
-            hist.precipitation = data['precipitation']
-            hist.wind_speed = data['wind_speed']
-        else:
-            hist = WeatherHistory(
-                user_id=user_id,
-                city_name=city_name,
-                date=date_obj,
-                temp_avg=data['temp_avg'],
-                temp_min=data['temp_min'],
-                temp_max=data['temp_max'],
-                condition=data['condition'],
-                precipitation=data['precipitation'],
-                wind_speed=data['wind_speed']
-            )
-            session.add(hist)
-        await session.commit()
+async def get_active_locations():
+    """Distinct locations that are the primary city of at least one active user."""
+    in_use = (
+        select(City.location_id)
+        .join(User, User.user_id == City.user_id)
+        .where(User.is_active == True, City.id == _primary_city_id())
+    )
+    stmt = select(_cols(Location)).where(Location.id.in_(in_use)).order_by(Location.id)
+    return await run_read(lambda session: _fetch_all(session, stmt))
 
-async def get_weekly_stats(user_id: int, city_name: str):
-    async with AsyncSessionLocal() as session:
-        result = await session.execute(
-            select(WeatherHistory)
-            .where(WeatherHistory.user_id == user_id, WeatherHistory.city_name == city_name)
-            .order_by(desc(WeatherHistory.date))
-            .limit(7)
-        )
-        hists = result.scalars().all()
-        return [{c.name: getattr(h, c.name) for c in h.__table__.columns} for h in hists]
+async def upsert_location_history(rows: list) -> int:
+    """
+    Writes daily history rows ({'location_id', 'date', temp_avg, ...}) with
+    INSERT ... ON CONFLICT (location_id, date) DO UPDATE. Returns the number of rows written.
+    """
+    values = [
+        dict(row, date=datetime.date.fromisoformat(row['date']) if isinstance(row['date'], str) else row['date'])
+        for row in rows
+    ]
+    if not values:
+        return 0
+    async with session_scope() as session:
+        written = await bulk_upsert(session, LocationHistory, values, index_elements=['location_id', 'date'])
+    return written
+
+async def get_weekly_stats(location_id: int):
+    stmt = (
+        select(_cols(LocationHistory))
+        .where(LocationHistory.location_id == location_id)
+        .order_by(desc(LocationHistory.date))
+        .limit(7)
+    )
+    return await run_read(lambda session: _fetch_all(session, stmt))
 
 async def get_notification_preferences(user_id: int):
-    async with AsyncSessionLocal() as session:
-        result = await session.execute(select(NotificationPreference).where(NotificationPreference.user_id == user_id))
-        row = result.scalar_one_or_none()
-        if not row:
-            row = NotificationPreference(user_id=user_id)
-            session.add(row)
-            await session.commit()
-            return {c.name: getattr(row, c.name) for c in row.__table__.columns}
-        return {c.name: getattr(row, c.name) for c in row.__table__.columns}
+    stmt = select(_cols(NotificationPreference)).where(NotificationPreference.user_id == user_id)
+    async with session_scope() as session:
+        prefs = await _fetch_one(session, stmt)
+        if not prefs:
+            # Create the defaults row; a concurrent request may already have done so
+            await bulk_upsert(session, NotificationPreference, [{'user_id': user_id}], index_elements=['user_id'], update_columns=())
+            prefs = await _fetch_one(session, stmt)
+        return prefs
+
+async def upsert_notification_preferences(rows: list) -> int:
+    """
+    Bulk-writes preference changes, e.g. [{'user_id': 1, 'rain_alerts': False}, ...].
+    Rows must share the same keys; users without a preferences row get one with defaults.
+    """
+    if not rows:
+        return 0
+    async with session_scope() as session:
+        written = await bulk_upsert(session, NotificationPreference, rows, index_elements=['user_id'])
+    return written
 
 async def update_notification_preference(user_id: int, column: str, value):
-    async with AsyncSessionLocal() as session:
-        await session.execute(update(NotificationPreference).where(NotificationPreference.user_id == user_id).values({column: value}))
-        await session.commit()
-
-async def save_weather_snapshot(user_id, city, temp, condition):
-    async with AsyncSessionLocal() as session:
-        snapshot = WeatherSnapshot(user_id=user_id, city_name=city, temp=temp, condition=condition)
-        session.add(snapshot)
-        cutoff = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(hours=48)
-        await session.execute(delete(WeatherSnapshot).where(WeatherSnapshot.timestamp < cutoff))
-        await session.commit()
-
-async def get_weather_comparison(user_id, city):
-    async with AsyncSessionLocal() as session:
-        target = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(hours=24)
-        low = target - datetime.timedelta(hours=1)
-        high = target + datetime.timedelta(hours=1)
-        
-        result = await session.execute(
-            select(WeatherSnapshot)
-            .where(WeatherSnapshot.user_id == user_id, WeatherSnapshot.city_name == city)
-            .where(WeatherSnapshot.timestamp.between(low, high))
-            .order_by(func.abs(func.extract('epoch', WeatherSnapshot.timestamp) - func.extract('epoch', target)) if DATABASE_PATH.startswith("postgres") else func.abs(func.julianday(WeatherSnapshot.timestamp) - func.julianday(target)))
-            .limit(1)
+    await upsert_notification_preferences([{'user_id': user_id, column: value}])
+
+def hour_bucket(moment: datetime.datetime) -> int:
+    """Hours since the Unix epoch, the bucket used by hourly_observations."""
+    return int(moment.timestamp() // 3600)
+
+def _as_utc(moment: datetime.datetime) -> datetime.datetime:
+    # SQLite hands back naive datetimes for timezone-aware columns
+    return moment if moment.tzinfo else moment.replace(tzinfo=datetime.timezone.utc)
+
+def hourly_observation_row(location_key: str, temp: float, condition: str, observed_at: datetime.datetime = None) -> dict:
+    observed_at = observed_at or datetime.datetime.now(datetime.timezone.utc)
+    return dict(location_key=location_key, hour_bucket=hour_bucket(observed_at),
+                temp=temp, condition=condition, observed_at=observed_at)
+
+async def save_hourly_observations(rows: list) -> int:
+    """Upserts observation rows; the latest observation in an hour wins."""
+    if not rows:
+        return 0
+    async with session_scope() as session:
+        return await bulk_upsert(session, HourlyObservation, rows, index_elements=['location_key', 'hour_bucket'])
+
+async def save_hourly_observation(location_key: str, temp: float, condition: str, observed_at: datetime.datetime = None):
+    """Records current conditions for a location; the latest observation in an hour wins."""
+    await save_hourly_observations([hourly_observation_row(location_key, temp, condition, observed_at)])
+
+async def get_weather_comparison(location_key: str, now: datetime.datetime = None):
+    """
+    Observation closest to 24 hours ago (within one hour), or None.
+    Reads at most three rows by primary key: the target hour and its neighbours.
+    """
+    target = (now or datetime.datetime.now(datetime.timezone.utc)) - datetime.timedelta(hours=24)
+    bucket = hour_bucket(target)
+    async with session_scope(write=False) as session:
+        rows = await _fetch_all(
+            session,
+            select(_cols(HourlyObservation))
+            .where(HourlyObservation.location_key == location_key)
+            .where(HourlyObservation.hour_bucket.between(bucket - 1, bucket + 1))
         )
-        row = result.scalar_one_or_none()
-        return {c.name: getattr(row, c.name) for c in row.__table__.columns} if row else None
+
+    window = datetime.timedelta(hours=1)
+    candidates = [r for r in rows if abs(_as_utc(r['observed_at']) - target) <= window]
+    if not candidates:
+        return None
+    return min(candidates, key=lambda r: abs(_as_utc(r['observed_at']) - target))
+
+async def prune_rows_before(model, column, cutoff, batch_size: int = PRUNE_BATCH_SIZE) -> int:
+    """
+    Deletes rows with column < cutoff in batches of `batch_size`, one short
+    transaction per batch so concurrent writers are never blocked for long.
+    Returns the number of deleted rows.
+    """
+    pk = list(model.__table__.primary_key.columns)
+    key = pk[0] if len(pk) == 1 else tuple_(*pk)
+    total = 0
+    while True:
+        async with AsyncSessionLocal() as session:
+            batch = select(*pk).where(column < cutoff).limit(batch_size)
+            result = await session.execute(delete(model).where(key.in_(batch)))
+            await session.commit()
+        total += result.rowcount
+        if result.rowcount < batch_size:
+            return total
+        # Let interactive requests run between batches
+        await asyncio.sleep(0)
+
+async def prune_expired_rows() -> dict:
+    """Applies the configured retention windows. Returns {table_name: deleted_rows}."""
+    now = datetime.datetime.now(datetime.timezone.utc)
+    policies = []
+    if HOURLY_OBSERVATION_RETENTION_HOURS > 0:
+        policies.append((HourlyObservation, HourlyObservation.hour_bucket, hour_bucket(now - datetime.timedelta(hours=HOURLY_OBSERVATION_RETENTION_HOURS))))
+    if WEATHER_HISTORY_RETENTION_DAYS > 0:
+        policies.append((LocationHistory, LocationHistory.date, now.date() - datetime.timedelta(days=WEATHER_HISTORY_RETENTION_DAYS)))
+    if ALERT_STATE_RETENTION_HOURS > 0:
+        policies.append((AlertState, AlertState.last_fired_at, now - datetime.timedelta(hours=ALERT_STATE_RETENTION_HOURS)))
+
+    report = {}
+    for model, column, cutoff in policies:
+        report[model.__tablename__] = await prune_rows_before(model, column, cutoff)
+    return report
+
+async def get_alert_states() -> list:
+    """Every stored alert state (one row per scope, alert type and fingerprint)."""
+    return await run_read(lambda session: _fetch_all(session, select(_cols(AlertState))))
+
+async def upsert_alert_states(rows: list) -> int:
+    """Writes alert firings and hysteresis resets: [{'scope', 'alert_type', 'fingerprint', ...}]."""
+    if not rows:
+        return 0
+    async with session_scope() as session:
+        return await bulk_upsert(session, AlertState, rows, index_elements=['scope', 'alert_type', 'fingerprint'])
 
 async def save_wardrobe_item(user_id: int, photo_id: str, data: dict):
-    async with AsyncSessionLocal() as session:
+    async with session_scope() as session:
         item = WardrobeItem(
             user_id=user_id,
             photo_file_id=photo_id,
@@ -227,23 +423,24 @@ async def save_wardrobe_item(user_id: int, photo_id: str, data: dict):
             description=data.get('description')
         )
         session.add(item)
-        await session.commit()
 
 async def get_users_with_null_timezone():
-    async with AsyncSessionLocal() as session:
+    async with session_scope() as session:
         result = await session.execute(select(User.user_id).where(User.timezone == None, User.timezone_initialized == 0))
         return [row[0] for row in result.fetchall()]
 
 async def mark_timezone_initialized(user_id: int):
-    async with AsyncSessionLocal() as session:
+    async with session_scope() as session:
         await session.execute(update(User).where(User.user_id == user_id).values(timezone_initialized=1))
-        await session.commit()
+
+async def _count_admin_stats(session):
+    stats = {}
+    stats['total_users'] = (await session.execute(select(func.count(User.user_id)))).scalar()
+    stats['active_users'] = (await session.execute(select(func.count(User.user_id)).where(User.is_active == True))).scalar()
+    stats['total_cities'] = (await session.execute(select(func.count(City.id)))).scalar()
+    stats['locations'] = (await session.execute(select(func.count(Location.id)))).scalar()
+    stats['history_records'] = (await session.execute(select(func.count(LocationHistory.id)))).scalar()
+    return stats
 
 async def get_admin_stats():
-    async with AsyncSessionLocal() as session:
-        stats = {}
-        stats['total_users'] = (await session.execute(select(func.count(User.user_id)))).scalar()
-        stats['active_users'] = (await session.execute(select(func.count(User.user_id)).where(User.is_active == True))).scalar()
-        stats['total_cities'] = (await session.execute(select(func.count(City.id)))).scalar()
-        stats['history_records'] = (await session.execute(select(func.count(WeatherHistory.id)))).scalar()
-        return stats
+    return await run_read(_count_admin_stats)
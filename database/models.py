@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Float, Boolean, DateTime, Date, ForeignKey, Text, UniqueConstraint
+from sqlalchemy import Column, Integer, String, Float, Boolean, DateTime, Date, ForeignKey, Text, UniqueConstraint, Index, PrimaryKeyConstraint
 from sqlalchemy.orm import declarative_base, relationship
 from sqlalchemy.sql import func
 
@@ -22,10 +22,10 @@ class User(Base):
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     last_notification = Column(DateTime(timezone=True))
 
+    __table_args__ = (Index('ix_users_active_notification_time', 'is_active', 'notification_time'),)
+
     cities = relationship("City", back_populates="user", cascade="all, delete-orphan")
-    history = relationship("WeatherHistory", back_populates="user", cascade="all, delete-orphan")
     preferences = relationship("NotificationPreference", uselist=False, back_populates="user", cascade="all, delete-orphan")
-    snapshots = relationship("WeatherSnapshot", back_populates="user", cascade="all, delete-orphan")
     wardrobe = relationship("WardrobeItem", back_populates="user", cascade="all, delete-orphan")
 
 class City(Base):
@@ -37,16 +37,36 @@ class City(Base):
     latitude = Column(Float)
     longitude = Column(Float)
     is_primary = Column(Boolean, default=False)
+    location_id = Column(Integer, ForeignKey("locations.id", name="fk_cities_location_id"))
     created_at = Column(DateTime(timezone=True), server_default=func.now())
 
+    __table_args__ = (
+        Index('ix_cities_user_primary', 'user_id', 'is_primary'),
+        Index('ix_cities_location_id', 'location_id'),
+    )
+
     user = relationship("User", back_populates="cities")
+    location = relationship("Location", back_populates="cities")
 
-class WeatherHistory(Base):
-    __tablename__ = "weather_history"
+class Location(Base):
+    """A place shared by every user whose city rounds to the same coordinates."""
+    __tablename__ = "locations"
 
     id = Column(Integer, primary_key=True, autoincrement=True)
-    user_id = Column(Integer, ForeignKey("users.user_id"), nullable=False)
-    city_name = Column(String, nullable=False)
+    key = Column(String, nullable=False, unique=True)  # core.geo.location_key, e.g. '55.76,37.62'
+    name = Column(String)
+    latitude = Column(Float, nullable=False)
+    longitude = Column(Float, nullable=False)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+    cities = relationship("City", back_populates="location")
+    history = relationship("LocationHistory", back_populates="location", cascade="all, delete-orphan")
+
+class LocationHistory(Base):
+    __tablename__ = "location_history"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    location_id = Column(Integer, ForeignKey("locations.id"), nullable=False)
     date = Column(Date, nullable=False)
     temp_avg = Column(Float)
     temp_min = Column(Float)
@@ -56,9 +76,13 @@ class WeatherHistory(Base):
     wind_speed = Column(Float)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
 
-    __table_args__ = (UniqueConstraint('user_id', 'city_name', 'date', name='_user_city_date_uc'),)
+    __table_args__ = (
+        UniqueConstraint('location_id', 'date', name='_location_date_uc'),
+        # Retention deletes by date across all locations; the unique key leads with location_id
+        Index('ix_location_history_date', 'date'),
+    )
 
-    user = relationship("User", back_populates="history")
+    location = relationship("Location", back_populates="history")
 
 class NotificationPreference(Base):
     __tablename__ = "notification_preferences"
@@ -78,17 +102,46 @@ class NotificationPreference(Base):
 
     user = relationship("User", back_populates="preferences")
 
-class WeatherSnapshot(Base):
-    __tablename__ = "weather_snapshots"
+class HourlyObservation(Base):
+    """
+    Current conditions per location and UTC hour, shared by every user in that place.
+    Backs the "yesterday at this hour" comparison with a primary-key range read.
+    """
+    __tablename__ = "hourly_observations"
 
-    id = Column(Integer, primary_key=True, autoincrement=True)
-    user_id = Column(Integer, ForeignKey("users.user_id"))
-    city_name = Column(String)
+    location_key = Column(String, nullable=False)  # locations.key
+    hour_bucket = Column(Integer, nullable=False)  # hours since the Unix epoch (UTC)
     temp = Column(Float)
     condition = Column(String)
-    timestamp = Column(DateTime(timezone=True), server_default=func.now())
-
-    user = relationship("User", back_populates="snapshots")
+    observed_at = Column(DateTime(timezone=True), nullable=False)
+
+    __table_args__ = (
+        PrimaryKeyConstraint('location_key', 'hour_bucket', name='pk_hourly_observations'),
+        # Retention deletes by hour across all locations; the key leads with location_key
+        Index('ix_hourly_observations_hour_bucket', 'hour_bucket'),
+        # Clustered on the key in SQLite, so the lookup never touches a separate rowid table
+        {'sqlite_with_rowid': False},
+    )
+
+class AlertState(Base):
+    """
+    Last firing of an alert occurrence, for cooldowns and de-duplication.
+    `scope` is 'location:<key>' or 'user:<id>'; `active` stays set until the
+    measured value falls back below the alert's hysteresis band.
+    """
+    __tablename__ = "alert_states"
+
+    scope = Column(String, nullable=False)
+    alert_type = Column(String, nullable=False)
+    fingerprint = Column(String, nullable=False, default="")
+    last_fired_at = Column(DateTime(timezone=True), nullable=False)
+    value = Column(Float)
+    active = Column(Boolean, nullable=False, default=True)
+
+    __table_args__ = (
+        PrimaryKeyConstraint('scope', 'alert_type', 'fingerprint', name='pk_alert_states'),
+        Index('ix_alert_states_last_fired_at', 'last_fired_at'),
+    )
 
 class WardrobeItem(Base):
     __tablename__ = "wardrobe"
@@ -1,31 +1,250 @@
+import logging
+import time
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from typing import Optional
+from sqlalchemy import event
+from sqlalchemy.exc import DBAPIError
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession, async_sessionmaker
-from config import DATABASE_PATH
-
-# Handle different database types
-if DATABASE_PATH.startswith("postgres"):
-    # Fix Railway's "postgres://" -> "postgresql+asyncpg://"
-    curr_url = DATABASE_PATH
-    if curr_url.startswith("postgres://"):
-        curr_url = curr_url.replace("postgres://", "postgresql+asyncpg://", 1)
-    elif curr_url.startswith("postgresql://"):
-        curr_url = curr_url.replace("postgresql://", "postgresql+asyncpg://", 1)
-    elif not curr_url.startswith("postgresql+asyncpg://"):
-        # Just in case it's something else
-        curr_url = curr_url.replace("://", "+asyncpg://", 1)
-    DB_URL = curr_url
-    
+from sqlalchemy.pool import QueuePool
+from config import (
+    DATABASE_PATH, READ_REPLICA_URL, READ_REPLICA_RETRY_AFTER,
+    DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_TIMEOUT, DB_POOL_RECYCLE, DB_POOL_PRE_PING, DB_STATEMENT_CACHE_SIZE,
+    SQLITE_JOURNAL_MODE, SQLITE_SYNCHRONOUS, SQLITE_BUSY_TIMEOUT_MS, SQLITE_CACHE_SIZE_KB, SQLITE_MMAP_SIZE
+)
+
+logger = logging.getLogger(__name__)
+
+def _database_url(path: str) -> str:
+    # Handle different database types
+    if path.startswith("postgres"):
+        # Fix Railway's "postgres://" -> "postgresql+asyncpg://"
+        if path.startswith("postgres://"):
+            return path.replace("postgres://", "postgresql+asyncpg://", 1)
+        if path.startswith("postgresql://"):
+            return path.replace("postgresql://", "postgresql+asyncpg://", 1)
+        if not path.startswith("postgresql+asyncpg://"):
+            # Just in case it's something else
+            return path.replace("://", "+asyncpg://", 1)
+        return path
+    if not path.startswith("sqlite"):
+        return f"sqlite+aiosqlite:///{path}"
+    return path
+
+def _apply_sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    try:
+        # WAL lets readers proceed while a writer commits; NORMAL is durable enough with WAL
+        cursor.execute(f"PRAGMA journal_mode={SQLITE_JOURNAL_MODE}")
+        cursor.execute(f"PRAGMA synchronous={SQLITE_SYNCHRONOUS}")
+        # Wait for a competing writer instead of failing with "database is locked"
+        cursor.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+        # Negative cache_size is in KiB
+        cursor.execute(f"PRAGMA cache_size=-{SQLITE_CACHE_SIZE_KB}")
+        cursor.execute(f"PRAGMA mmap_size={SQLITE_MMAP_SIZE}")
+        cursor.execute("PRAGMA temp_store=MEMORY")
+    finally:
+        cursor.close()
+
+def create_engine_for(url: str):
+    """Async engine with the configured pool (PostgreSQL) or PRAGMA profile (SQLite)."""
+    if url.startswith("postgresql"):
+        return create_async_engine(
+            url,
+            echo=False,
+            pool_size=DB_POOL_SIZE,
+            max_overflow=DB_MAX_OVERFLOW,
+            pool_timeout=DB_POOL_TIMEOUT,
+            pool_recycle=DB_POOL_RECYCLE,
+            pool_pre_ping=DB_POOL_PRE_PING,
+            connect_args={"statement_cache_size": DB_STATEMENT_CACHE_SIZE},
+        )
+    sqlite_engine = create_async_engine(url, echo=False)
+    if ":memory:" not in url and "mode=memory" not in url:
+        event.listen(sqlite_engine.sync_engine, "connect", _apply_sqlite_pragmas)
+    return sqlite_engine
+
+def get_pool_stats(target=None) -> dict:
+    """Connection pool counters for /admin."""
+    pool = (target or engine).pool
+    stats = {'pool': type(pool).__name__, 'status': pool.status()}
+    if isinstance(pool, QueuePool):
+        stats.update(size=pool.size(), checked_out=pool.checkedout(), checked_in=pool.checkedin(), overflow=pool.overflow())
+    return stats
+
+DB_URL = _database_url(DATABASE_PATH)
+if DB_URL.startswith("postgresql"):
     # Log the connection (hiding password)
     import re
     masked_url = re.sub(r':([^/@]+)@', ':****@', DB_URL)
     print(f"🔌 Connecting to database: {masked_url}")
-elif not DATABASE_PATH.startswith("sqlite"):
-    DB_URL = f"sqlite+aiosqlite:///{DATABASE_PATH}"
-else:
-    DB_URL = DATABASE_PATH
 
-engine = create_async_engine(DB_URL, echo=False)
+engine = create_engine_for(DB_URL)
 AsyncSessionLocal = async_sessionmaker(engine, expire_on_commit=False, class_=AsyncSession)
 
+# Read replica: read-only functions go through run_read(), everything else uses the primary
+read_engine = create_engine_for(_database_url(READ_REPLICA_URL)) if READ_REPLICA_URL else None
+ReadSessionLocal = async_sessionmaker(read_engine, expire_on_commit=False, class_=AsyncSession) if read_engine else None
+
 async def get_db():
     async with AsyncSessionLocal() as session:
         yield session
+
+# --- Unit of work -----------------------------------------------------------
+# A Telegram update runs inside unit_of_work(): every database call made while
+# handling it joins one ambient session, and the writes are committed together
+# instead of one session checkout and commit per call. Handlers and services
+# call commit_unit_of_work() where their database phase ends, before network I/O
+# or the confirmation reply, so no transaction or pooled connection is held
+# across a WeatherAPI or Telegram call and a reply never confirms a write that
+# isn't committed yet; the exit commit is then a no-op.
+
+class UnitOfWork:
+    __slots__ = ('session', 'active', 'statements', 'checkouts')
+
+    def __init__(self, session: AsyncSession):
+        self.session = session
+        self.active = True
+        self.statements = 0
+        self.checkouts = 0
+
+_current_uow: ContextVar[Optional[UnitOfWork]] = ContextVar('db_unit_of_work', default=None)
+
+_uow_totals = {'units': 0, 'statements': 0, 'checkouts': 0, 'max_statements': 0, 'rollbacks': 0}
+
+def current_unit_of_work() -> Optional[UnitOfWork]:
+    uow = _current_uow.get()
+    return uow if uow is not None and uow.active else None
+
+@asynccontextmanager
+async def unit_of_work():
+    """Shares one session across all DB calls in the block; commits once on exit, rolls back on error."""
+    if current_unit_of_work():
+        yield current_unit_of_work()
+        return
+
+    uow = UnitOfWork(AsyncSessionLocal())
+    token = _current_uow.set(uow)
+    try:
+        yield uow
+        await uow.session.commit()
+    except BaseException:
+        _uow_totals['rollbacks'] += 1
+        await uow.session.rollback()
+        raise
+    finally:
+        # Tasks spawned during the update inherit the context var; deactivating
+        # makes them open their own sessions instead of using a closed one
+        uow.active = False
+        _current_uow.reset(token)
+        await uow.session.close()
+        _uow_totals['units'] += 1
+        _uow_totals['statements'] += uow.statements
+        _uow_totals['checkouts'] += uow.checkouts
+        _uow_totals['max_statements'] = max(_uow_totals['max_statements'], uow.statements)
+
+async def commit_unit_of_work():
+    """
+    Commits the ambient unit of work's writes so far and releases its connection.
+    Called where a handler's database phase ends; later calls in the same unit
+    reuse the session in a new transaction. No-op outside a unit of work or when
+    nothing has run since the last commit.
+    """
+    uow = current_unit_of_work()
+    if uow and uow.session.in_transaction():
+        await uow.session.commit()
+
+@asynccontextmanager
+async def session_scope(write: bool = True):
+    """
+    Session for a data-access call: the ambient unit-of-work session if there
+    is one (commit deferred to the unit's next commit point), otherwise a
+    short-lived session committed on exit. Reads that must see the primary
+    pass write=False to skip the savepoint a joined write gets on PostgreSQL.
+    """
+    uow = current_unit_of_work()
+    postgres = uow is not None and uow.session.bind.dialect.name == "postgresql"
+    if uow and write and postgres:
+        # A failed statement aborts the whole PostgreSQL transaction; the savepoint
+        # undoes only this call, keeping the unit's earlier pending writes
+        try:
+            async with uow.session.begin_nested():
+                yield uow.session
+        except Exception:
+            _uow_totals['rollbacks'] += 1
+            raise
+        return
+    if uow:
+        try:
+            yield uow.session
+        except Exception:
+            # SQLite undoes just the failed statement and the transaction stays
+            # usable; a failed PostgreSQL read (no savepoint) or ORM flush doesn't
+            if postgres or not uow.session.is_active:
+                _uow_totals['rollbacks'] += 1
+                await uow.session.rollback()
+            raise
+        return
+
+    async with AsyncSessionLocal() as session:
+        yield session
+        await session.commit()
+
+_read_totals = {'replica': 0, 'primary': 0, 'fallbacks': 0}
+_replica_down_until = 0.0
+
+async def run_read(query):
+    """
+    Runs `query(session)` for a read-only function.
+    Inside a unit of work it uses the update's session, so the update sees its own
+    writes; otherwise it prefers the replica and falls back to the primary when the
+    replica errors, skipping the replica for READ_REPLICA_RETRY_AFTER seconds.
+    Reads are idempotent, so re-running the query on the primary is safe.
+    """
+    global _replica_down_until
+    uow = current_unit_of_work()
+    if uow:
+        return await query(uow.session)
+
+    if ReadSessionLocal is not None and time.monotonic() >= _replica_down_until:
+        try:
+            async with ReadSessionLocal() as session:
+                result = await query(session)
+            _read_totals['replica'] += 1
+            return result
+        except (DBAPIError, OSError) as e:
+            _replica_down_until = time.monotonic() + READ_REPLICA_RETRY_AFTER
+            _read_totals['fallbacks'] += 1
+            logger.warning(f"Read replica unavailable, using primary for {READ_REPLICA_RETRY_AFTER}s: {e}")
+
+    async with AsyncSessionLocal() as session:
+        result = await query(session)
+    _read_totals['primary'] += 1
+    return result
+
+def get_read_routing_stats() -> dict:
+    return dict(
+        _read_totals,
+        replica_configured=read_engine is not None,
+        replica_healthy=read_engine is not None and time.monotonic() >= _replica_down_until,
+    )
+
+def get_unit_of_work_stats() -> dict:
+    units = _uow_totals['units'] or 1
+    return dict(
+        _uow_totals,
+        avg_statements=_uow_totals['statements'] / units,
+        avg_checkouts=_uow_totals['checkouts'] / units,
+    )
+
+@event.listens_for(engine.sync_engine, "before_cursor_execute")
+def _count_statement(conn, cursor, statement, parameters, context, executemany):
+    uow = _current_uow.get()
+    if uow is not None:
+        uow.statements += 1
+
+@event.listens_for(engine.sync_engine.pool, "checkout")
+def _count_checkout(dbapi_connection, connection_record, connection_proxy):
+    uow = _current_uow.get()
+    if uow is not None:
+        uow.checkouts += 1
@@ -0,0 +1,43 @@
+"""
+Dialect-aware bulk upsert (INSERT ... ON CONFLICT) for SQLite and PostgreSQL.
+"""
+from typing import Iterable, List, Optional, Sequence
+from sqlalchemy.dialects import postgresql, sqlite
+
+# Bound parameters per statement: SQLite >= 3.32 allows 32766, PostgreSQL 32767
+MAX_PARAMS = 32000
+
+def dialect_insert(session):
+    """INSERT construct with ON CONFLICT support for the session's backend."""
+    return postgresql.insert if session.bind.dialect.name == "postgresql" else sqlite.insert
+
+async def bulk_upsert(session, model, rows: Iterable[dict], index_elements: Sequence[str],
+                      update_columns: Optional[Sequence[str]] = None, batch_size: int = 1000) -> int:
+    """
+    Inserts `rows` into `model`, updating `update_columns` (default: every
+    non-key column present in the rows) when `index_elements` conflict.
+    With update_columns=() conflicting rows are left untouched.
+
+    Rows are written in multi-row statements sized to the dialect's
+    parameter limit. Does not commit. Returns the number of rows sent.
+    """
+    rows: List[dict] = list(rows)
+    if not rows:
+        return 0
+    columns = list(rows[0])
+    if update_columns is None:
+        update_columns = [c for c in columns if c not in index_elements]
+    insert = dialect_insert(session)
+    chunk = max(1, min(batch_size, MAX_PARAMS // len(columns)))
+
+    for i in range(0, len(rows), chunk):
+        stmt = insert(model).values(rows[i:i + chunk])
+        if update_columns:
+            stmt = stmt.on_conflict_do_update(
+                index_elements=list(index_elements),
+                set_={col: stmt.excluded[col] for col in update_columns}
+            )
+        else:
+            stmt = stmt.on_conflict_do_nothing(index_elements=list(index_elements))
+        await session.execute(stmt)
+    return len(rows)
@@ -0,0 +1,178 @@
+"""
+Write-behind buffer for high-frequency, non-critical writes.
+
+Weather views and broadcasts used to commit an observation, a streak or a
+last_notification stamp before replying. Those writes now land in memory and
+are flushed in bulk every WRITE_BEHIND_FLUSH_INTERVAL_MS or as soon as
+WRITE_BEHIND_MAX_BATCH records are waiting, so user-visible latency no longer
+includes a DB commit.
+
+Records are keyed: a newer write for the same key replaces the pending one
+(last write wins) and kinds are flushed in registration order, oldest record
+first. A record leaves the buffer only after its batch has committed, so until
+then readers can see it via `pending()` and a failed flush is simply retried.
+Flushes always run in their own task with an empty context, so flush functions
+open their own sessions and never join the unit of work of the update that
+triggered them: a rollback there would lose records already taken off the buffer.
+"""
+import asyncio
+import contextvars
+import datetime
+import logging
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Optional
+from config import WRITE_BEHIND_FLUSH_INTERVAL_MS, WRITE_BEHIND_MAX_BATCH, WRITE_BEHIND_MAX_PENDING
+from database import save_hourly_observations, apply_streak_updates, set_last_notifications, hourly_observation_row
+
+logger = logging.getLogger(__name__)
+
+FlushFn = Callable[[List[Any]], Awaitable[Any]]
+
+class WriteBehindBuffer:
+    """
+    Per-kind ordered maps of pending records plus one background flusher.
+    Memory is bounded by `max_pending`: writers wait for a background flush once
+    it is reached, and if the database stays unavailable the oldest records are dropped.
+    When the buffer is not running, submits are written through immediately.
+    """
+
+    def __init__(self, flush_interval: float = WRITE_BEHIND_FLUSH_INTERVAL_MS / 1000,
+                 max_batch: int = WRITE_BEHIND_MAX_BATCH, max_pending: int = WRITE_BEHIND_MAX_PENDING):
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+        self.max_pending = max_pending
+        self._flushers: Dict[str, FlushFn] = {}
+        self._pending: Dict[str, OrderedDict] = {}
+        self._task: Optional[asyncio.Task] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._lock: Optional[asyncio.Lock] = None
+        self.flushes = 0
+        self.written = 0
+        self.failed = 0
+        self.dropped = 0
+        self.last_flush_ms = 0.0
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None
+
+    def register(self, kind: str, flush_fn: FlushFn):
+        """`flush_fn` receives a list of values and must write them in one transaction."""
+        self._flushers[kind] = flush_fn
+        self._pending.setdefault(kind, OrderedDict())
+
+    def start(self):
+        if self.running:
+            return
+        self._wakeup = asyncio.Event()
+        self._lock = asyncio.Lock()
+        self._task = asyncio.create_task(self._run(), name="write-behind")
+        logger.info(f"🧾 Write-behind buffer started (every {self.flush_interval * 1000:.0f} ms or {self.max_batch} records)")
+
+    async def stop(self):
+        """Stops the flusher and writes out everything still pending."""
+        if not self.running:
+            return
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+        await self.flush()
+        left = self.pending_count()
+        if left:
+            logger.error(f"Write-behind buffer stopped with {left} unwritten records")
+
+    async def submit(self, kind: str, key: Hashable, value: Any):
+        """Queues `value` under `key`, replacing any pending value for the same key."""
+        if not self.running:
+            await self._flushers[kind]([value])
+            return
+        if self.pending_count() >= self.max_pending:
+            await self.flush()
+            while self.pending_count() >= self.max_pending:
+                self._drop_oldest()
+        records = self._pending[kind]
+        records.pop(key, None)
+        records[key] = value
+        if self.pending_count() >= self.max_batch:
+            self._wakeup.set()
+
+    def pending(self, kind: str, key: Hashable, default: Any = None) -> Any:
+        """The value waiting to be written for `key`, if any."""
+        return self._pending.get(kind, {}).get(key, default)
+
+    def pending_count(self) -> int:
+        return sum(len(records) for records in self._pending.values())
+
+    async def flush(self):
+        """Writes every pending record, one batch per kind at a time."""
+        task = asyncio.create_task(self._flush(), name="write-behind-flush", context=contextvars.Context())
+        # A cancelled caller must not abort a batch halfway through
+        await asyncio.shield(task)
+
+    async def _flush(self):
+        async with self._lock or asyncio.Lock():
+            started = time.perf_counter()
+            for kind, flush_fn in self._flushers.items():
+                records = self._pending[kind]
+                while records:
+                    batch = list(records.items())[:self.max_batch]
+                    try:
+                        await flush_fn([value for _, value in batch])
+                    except Exception as e:
+                        self.failed += 1
+                        logger.error(f"Write-behind flush of {len(batch)} {kind} records failed: {e}")
+                        break
+                    self.flushes += 1
+                    self.written += len(batch)
+                    for key, value in batch:
+                        # Keep records that were replaced while the batch was being written
+                        if records.get(key) is value:
+                            del records[key]
+            self.last_flush_ms = (time.perf_counter() - started) * 1000
+
+    def stats(self) -> dict:
+        return {
+            'pending': self.pending_count(),
+            'flushes': self.flushes,
+            'written': self.written,
+            'failed': self.failed,
+            'dropped': self.dropped,
+            'last_flush_ms': self.last_flush_ms,
+        }
+
+    def _drop_oldest(self):
+        kind = max(self._pending, key=lambda k: len(self._pending[k]))
+        key, _ = self._pending[kind].popitem(last=False)
+        self.dropped += 1
+        logger.error(f"Write-behind buffer full, dropped pending {kind} record {key!r}")
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            if self.pending_count():
+                await self.flush()
+
+# Global buffer, started in post_init and flushed in post_shutdown
+write_behind = WriteBehindBuffer()
+write_behind.register('hourly_observation', save_hourly_observations)
+write_behind.register('streak', apply_streak_updates)
+write_behind.register('last_notification', set_last_notifications)
+
+async def record_hourly_observation(location_key: str, temp: float, condition: str):
+    row = hourly_observation_row(location_key, temp, condition)
+    await write_behind.submit('hourly_observation', (location_key, row['hour_bucket']), row)
+
+async def record_last_notification(user_id: int, sent_at=None):
+    sent_at = sent_at or datetime.datetime.now(datetime.timezone.utc)
+    await write_behind.submit('last_notification', user_id, {'user_id': user_id, 'last_notification': sent_at})
+
+async def record_streak(user_id: int, last_check_date, current_streak: int, best_streak: int):
+    await write_behind.submit('streak', user_id, {
+        'user_id': user_id, 'last_check_date': last_check_date,
+        'current_streak': current_streak, 'best_streak': best_streak,
+    })
@@ -1,8 +1,9 @@
 import logging
 from telegram import Update
 from telegram.ext import ContextTypes
-from database import get_user_cities, set_primary_city, add_city
+from database import get_user_cities, set_primary_city, add_city, commit_unit_of_work
 from keyboards import get_cities_keyboard, get_main_menu_keyboard
+from services.alert_subscriptions import refresh_user_subscriptions
 
 logger = logging.getLogger(__name__)
 
@@ -25,8 +26,10 @@ async def set_primary_city_handler(update: Update, context: ContextTypes.DEFAULT
     cid = int(query.data.split("_")[2])
     
     await set_primary_city(user_id, cid)
+    await refresh_user_subscriptions(user_id)
     cities = await get_user_cities(user_id)
     city_name = next((c['city_name'] for c in cities if c['id'] == cid), "город")
+    await commit_unit_of_work()
     
     await query.edit_message_reply_markup(reply_markup=get_cities_keyboard(cities, cid))
     await query.answer(f"✅ Основной город: {city_name}")
@@ -64,6 +67,8 @@ async def delete_city_handler(update: Update, context: ContextTypes.DEFAULT_TYPE
     city_id = int(query.data.replace("delete_city_", ""))
     
     await remove_city(user_id, city_id)
+    await refresh_user_subscriptions(user_id)
+    await commit_unit_of_work()
     await query.answer("✅ Город удален", show_alert=True)
     
     # Return to city list
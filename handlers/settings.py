@@ -3,7 +3,7 @@ from telegram import Update
 from telegram.ext import ContextTypes
 from database import (
     get_user, update_user_field, get_notification_preferences, 
-    update_notification_preference, update_user_timezone
+    update_notification_preference, update_user_timezone, commit_unit_of_work
 )
 from keyboards import (
     get_settings_keyboard, get_notification_settings_keyboard, 
@@ -11,6 +11,7 @@ from keyboards import (
     NOTIFICATION_PREFS, CHANGE_TIME, CHANGE_SENSITIVITY, CHANGE_NAME, CHANGE_TIMEZONE
 )
 from timezones import get_timezone_keyboard
+from services.alert_subscriptions import alert_subscriptions
 
 logger = logging.getLogger(__name__)
 
@@ -48,7 +49,9 @@ async def toggle_notification_handler(update: Update, context: ContextTypes.DEFA
     new_state = not prefs.get(key, True)
     
     await update_notification_preference(user_id, key, new_state)
-    new_prefs = await get_notification_preferences(user_id)
+    await commit_unit_of_work()
+    alert_subscriptions.set_flag(user_id, key, new_state)
+    new_prefs = dict(prefs, **{key: new_state})
     
     await query.edit_message_reply_markup(reply_markup=get_notification_settings_keyboard(new_prefs))
     status = "✅ Включено" if new_state else "❌ Выключено"
@@ -75,6 +78,7 @@ async def set_sensitivity_handler(update: Update, context: ContextTypes.DEFAULT_
     await update_user_field(user_id, 'temperature_sensitivity', m[query.data])
     
     user = await get_user(user_id)
+    await commit_unit_of_work()
     await query.edit_message_text(
         "✅ Сохранено.\n⚙️ <b>Настройки</b>", 
         reply_markup=get_settings_keyboard(user['is_active'], user['alerts_enabled']), 
@@ -7,12 +7,15 @@ import html
 from telegram import Update, ReplyKeyboardMarkup, ReplyKeyboardRemove, KeyboardButton
 from telegram.ext import ContextTypes, ConversationHandler
 
-from database import upsert_user, add_city, get_user, get_primary_city, update_user_timezone
+from database import upsert_user, add_city, get_user, get_primary_city, update_user_timezone, commit_unit_of_work
 from services.weather_service import generate_weather_message_content
 from weather import get_coordinates
 from streak import update_streak, get_streak_message
 from keyboards import get_main_reply_keyboard, get_weather_action_buttons, get_timezone_keyboard, get_extended_timezone_keyboard
 from timezones import get_timezone_display_name, TIMEZONE_PREFIX, TIMEZONE_OTHER
+from services.notification_schedule import refresh_user_schedule
+from services.alert_subscriptions import refresh_user_subscriptions
+from scheduler import schedule_alert_cohorts
 
 logger = logging.getLogger(__name__)
 
@@ -37,6 +40,7 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
         if user:
             logger.info(f"✅ User {user_id} уже зарегистрирован")
             await update_streak(user_id)
+            await commit_unit_of_work()
             await update.message.reply_text(
                 f"👋 С возвращением, {user['user_name']}!\n\n"
                 f"Используйте меню ниже для получения прогноза или настроек.",
@@ -154,6 +158,10 @@ async def ask_timezone_handler(update: Update, context: ContextTypes.DEFAULT_TYP
             else:
                 # НАСТРОЙКИ (смена таймзоны)
                 await update_user_timezone(user_id, tz)
+                await refresh_user_schedule(user_id)
+                await refresh_user_subscriptions(user_id)
+                await commit_unit_of_work()
+                schedule_alert_cohorts(context.job_queue)
                 await query.edit_message_text(
                     f"✅ <b>Часовой пояс обновлен:</b>\n{tz_display}\n\n"
                     "Теперь уведомления будут приходить по этому времени.",
@@ -234,6 +242,10 @@ async def ask_location(update: Update, context: ContextTypes.DEFAULT_TYPE):
         try:
             await upsert_user(user_id, user.username, user_name=name, timezone=tz)
             await add_city(user_id, city_name, lat, lon, is_primary=True)
+            await refresh_user_schedule(user_id)
+            await refresh_user_subscriptions(user_id)
+            await commit_unit_of_work()
+            schedule_alert_cohorts(context.job_queue)
             logger.info(f"✅ User {user_id} успешно сохранен в БД")
         except Exception as e:
             logger.error(f"❌ Ошибка сохранения в БД для user {user_id}: {e}", exc_info=True)
@@ -261,8 +273,9 @@ async def ask_location(update: Update, context: ContextTypes.DEFAULT_TYPE):
         # Получаем и отправляем прогноз погоды
         try:
             city_data = await get_primary_city(user_id)
-            weather_msg = await generate_weather_message_content(user_id, city_data)
+            # The streak write is committed by generate_weather_message_content
             current_streak, best_streak, is_new_record = await update_streak(user_id)
+            weather_msg = await generate_weather_message_content(user_id, city_data)
             streak_msg = get_streak_message(current_streak, is_new_record)
             
             await msg.reply_text(
@@ -21,7 +21,7 @@ async def show_stats_handler(update: Update, context: ContextTypes.DEFAULT_TYPE)
         else: await update.message.reply_text(msg)
         return
 
-    history = await get_weekly_stats(user_id, city['city_name'])
+    history = await get_weekly_stats(city['location_id']) if city.get('location_id') else []
     
     if len(history) < 2:
         msg = "⚠️ Недостаточно данных для статистики. Подождите пару дней."
@@ -1,11 +1,13 @@
 from telegram import Update
 from telegram.ext import ContextTypes
-from database import update_user_field, add_city, get_user, upsert_user
+from database import update_user_field, add_city, get_user, upsert_user, commit_unit_of_work
 from weather import get_coordinates
 from keyboards import get_settings_keyboard, get_main_menu_keyboard, WEATHER_NOW, SETTINGS, STATS, HELP
 from handlers.weather import weather_now_handler
 from handlers.stats import show_stats_handler
 from handlers.menu import help_handler
+from services.notification_schedule import refresh_user_schedule
+from services.alert_subscriptions import refresh_user_subscriptions
 
 async def handle_text_input(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
@@ -42,6 +44,8 @@ async def handle_text_input(update: Update, context: ContextTypes.DEFAULT_TYPE):
             return
         lat, lon = coords
         await add_city(user_id, text, lat, lon)
+        await refresh_user_subscriptions(user_id)
+        await commit_unit_of_work()
         context.user_data['state'] = None
         await update.message.reply_text(f"✅ Город <b>{text}</b> добавлен!", parse_mode='HTML', reply_markup=get_main_menu_keyboard())
 
@@ -52,8 +56,10 @@ async def handle_text_input(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 h, m = map(int, text.split(':'))
                 if 0 <= h <= 23 and 0 <= m <= 59:
                     await update_user_field(user_id, 'notification_time', text)
+                    await refresh_user_schedule(user_id)
                     context.user_data['state'] = None
                     user = await get_user(user_id)
+                    await commit_unit_of_work()
                     await update.message.reply_text(f"✅ Время уведомлений: {text}", reply_markup=get_settings_keyboard(user['is_active'], user['alerts_enabled']), parse_mode='HTML')
                 else:
                     await update.message.reply_text("❌ Неверное время. Часы 00-23, минуты 00-59. Пример: 08:30")
@@ -66,8 +72,10 @@ async def handle_text_input(update: Update, context: ContextTypes.DEFAULT_TYPE):
         name = text.strip()
         if 2 <= len(name) <= 50:
             await update_user_field(user_id, 'user_name', name)
+            await refresh_user_subscriptions(user_id)
             context.user_data['state'] = None
             user = await get_user(user_id)
+            await commit_unit_of_work()
             await update.message.reply_text(f"✅ Теперь я зову вас: {name}", reply_markup=get_settings_keyboard(user['is_active'], user['alerts_enabled']), parse_mode='HTML')
         elif len(name) < 2:
             await update.message.reply_text("❌ Имя слишком короткое (минимум 2 символа).")
@@ -1,11 +1,11 @@
 import logging
 from telegram import Update
 from telegram.ext import ContextTypes
-from database import get_primary_city, get_user
+from database import get_primary_city, get_user, commit_unit_of_work
 from services.weather_service import generate_weather_message_content
 from streak import update_streak, get_streak_message
 from keyboards import get_weather_action_buttons, WEATHER_NOW, REFRESH_WEATHER, WEATHER_DETAILS
-from weather import get_uv_index
+from weather import get_weather_bundle
 from analytics import format_uv_recommendation
 
 logger = logging.getLogger(__name__)
@@ -42,6 +42,8 @@ async def weather_details_handler(update: Update, context: ContextTypes.DEFAULT_
     await query.answer()
     
     city = await get_primary_city(user_id)
-    uv = await get_uv_index(city['city_name'])
+    await commit_unit_of_work()
+    bundle = await get_weather_bundle(lat=city['latitude'], lon=city['longitude'])
+    uv = bundle.uv_index if bundle else 0
     rec = format_uv_recommendation(uv)
     await query.message.reply_text(f"📊 <b>Подробности</b>\n\n{rec}", parse_mode='HTML')
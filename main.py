@@ -28,7 +28,13 @@ from handlers.menu import main_menu_callback_handler, help_handler
 from handlers.text_input import handle_text_input
 
 from scheduler import setup_scheduler
+from services.notification_schedule import load_notification_schedule
+from services.alert_subscriptions import load_alert_subscriptions
+from services.delivery import delivery_queue
+from database.write_behind import write_behind
+from services.alert_state import alert_states
 from database import init_db
+from weather import init_weather_client, close_weather_client
 from keyboards import (
     WEATHER_NOW, REFRESH_WEATHER, WEATHER_DETAILS, SETTINGS, 
     WEATHER_STATS, STATS, HELP, BACK_TO_MENU, NOTIFICATION_PREFS,
@@ -43,6 +49,11 @@ logger = setup_logging(LOG_LEVEL)
 async def post_init_logic(application):
     """Actions after application starts."""
     await init_db()
+    await init_weather_client()
+    await load_notification_schedule()
+    await load_alert_subscriptions()
+    delivery_queue.start(application.bot)
+    write_behind.start()
     setup_scheduler(application)
     
     # Log startup diagnostics
@@ -56,18 +67,48 @@ async def post_init_logic(application):
         logger.warning(f"Could not log user info: {e}")
         logger.info("🚀 Bot is up and running!")
 
+async def post_shutdown_logic(application):
+    """Actions after application stops."""
+    await delivery_queue.stop()
+    await write_behind.stop()
+    await close_weather_client()
+
 async def admin_command(update, context):
     """Admin only: show bot stats."""
     if str(update.effective_user.id) != str(ADMIN_ID):
         return
-    from database import get_admin_stats
+    from database import get_admin_stats, get_unit_of_work_stats, get_pool_stats, get_read_routing_stats
+    from weather import get_weather_cache_stats, get_weather_coalescing_stats
     stats = await get_admin_stats()
+    cache = get_weather_cache_stats()
+    flights = get_weather_coalescing_stats()
+    outbox = delivery_queue.stats()
+    buffered = write_behind.stats()
+    alerts = alert_states.stats()
+    uow = get_unit_of_work_stats()
+    pool = get_pool_stats()
+    reads = get_read_routing_stats()
     msg = (
         f"📊 <b>Bot Admin Stats</b>\n\n"
         f"👥 Users: {stats['total_users']} ({stats['active_users']} active)\n"
-        f"🏙 Cities: {stats['total_cities']}\n"
-        f"📜 History: {stats['history_records']}"
+        f"🏙 Cities: {stats['total_cities']} ({stats['locations']} distinct locations)\n"
+        f"📜 History: {stats['history_records']}\n"
+        f"🗃 Weather cache: {cache['size']}/{cache['max_entries']}, "
+        f"hit rate {cache['hit_rate']:.0%} ({cache['hits']} hits, {cache['misses']} misses, {cache['evictions']} evicted)\n"
+        f"🔗 WeatherAPI requests: {flights['executions']} sent, {flights['coalesced']} coalesced\n"
+        f"📮 Outbox: {outbox['pending']} pending, {outbox['sent']} sent, {outbox['retried']} retried, {outbox['failed']} failed\n"
+        f"🧾 Write-behind: {buffered['pending']} pending, {buffered['written']} written in {buffered['flushes']} flushes, "
+        f"{buffered['failed']} failed, {buffered['dropped']} dropped\n"
+        f"🔕 Alerts: {alerts['fired']} fired, {alerts['suppressed']} suppressed, {alerts['entries']} tracked\n"
+        f"🗄 DB per update: {uow['avg_statements']:.1f} statements (max {uow['max_statements']}), "
+        f"{uow['avg_checkouts']:.1f} connections over {uow['units']} updates\n"
+        f"🔌 DB pool: {pool['status']}"
     )
+    if reads['replica_configured']:
+        msg += (
+            f"\n📖 Read replica: {'up' if reads['replica_healthy'] else 'down'}, "
+            f"{reads['replica']} reads, {reads['primary']} on primary, {reads['fallbacks']} fallbacks"
+        )
     await update.message.reply_text(msg, parse_mode='HTML')
 
 def main():
@@ -127,6 +168,7 @@ def main():
 
     # Post init
     application.post_init = post_init_logic
+    application.post_shutdown = post_shutdown_logic
 
     # Start
     application.run_polling()
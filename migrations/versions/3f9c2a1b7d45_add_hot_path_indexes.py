@@ -0,0 +1,39 @@
+"""Add indexes for hot query paths
+
+Revision ID: 3f9c2a1b7d45
+Revises: 70444ab7291e
+Create Date: 2026-10-16 10:12:41.518230
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3f9c2a1b7d45'
+down_revision: Union[str, Sequence[str], None] = '70444ab7291e'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # if_not_exists: init_db's create_all already builds these on fresh databases
+    # get_primary_city / get_user_cities / iter_active_users_with_city
+    op.create_index('ix_cities_user_primary', 'cities', ['user_id', 'is_primary'], unique=False, if_not_exists=True)
+    # get_all_active_users and the notification scheduler
+    op.create_index('ix_users_active_notification_time', 'users', ['is_active', 'notification_time'], unique=False, if_not_exists=True)
+    # get_weather_comparison range scan
+    op.create_index('ix_weather_snapshots_user_city_ts', 'weather_snapshots', ['user_id', 'city_name', 'timestamp'], unique=False, if_not_exists=True)
+    # snapshot retention delete
+    op.create_index('ix_weather_snapshots_timestamp', 'weather_snapshots', ['timestamp'], unique=False, if_not_exists=True)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_weather_snapshots_timestamp', table_name='weather_snapshots', if_exists=True)
+    op.drop_index('ix_weather_snapshots_user_city_ts', table_name='weather_snapshots', if_exists=True)
+    op.drop_index('ix_users_active_notification_time', table_name='users', if_exists=True)
+    op.drop_index('ix_cities_user_primary', table_name='cities', if_exists=True)
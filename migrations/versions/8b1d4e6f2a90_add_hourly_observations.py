@@ -0,0 +1,41 @@
+"""Add hourly_observations for the yesterday-at-this-hour comparison
+
+Revision ID: 8b1d4e6f2a90
+Revises: 3f9c2a1b7d45
+Create Date: 2026-10-16 11:02:17.904512
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '8b1d4e6f2a90'
+down_revision: Union[str, Sequence[str], None] = '3f9c2a1b7d45'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # if_not_exists: init_db's create_all already builds it on fresh databases
+    op.create_table('hourly_observations',
+    sa.Column('location_key', sa.String(), nullable=False),
+    sa.Column('hour_bucket', sa.Integer(), nullable=False),
+    sa.Column('temp', sa.Float(), nullable=True),
+    sa.Column('condition', sa.String(), nullable=True),
+    sa.Column('observed_at', sa.DateTime(timezone=True), nullable=False),
+    sa.PrimaryKeyConstraint('location_key', 'hour_bucket', name='pk_hourly_observations'),
+    sqlite_with_rowid=False,
+    if_not_exists=True
+    )
+    op.create_index('ix_hourly_observations_hour_bucket', 'hourly_observations', ['hour_bucket'], unique=False, if_not_exists=True)
+    # weather_snapshots is no longer written; d2f8c6a41b93 drops it
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_hourly_observations_hour_bucket', table_name='hourly_observations', if_exists=True)
+    op.drop_table('hourly_observations', if_exists=True)
@@ -0,0 +1,28 @@
+"""Add a date index on location_history for the retention job
+
+Revision ID: a9d4b2e7c158
+Revises: e5a3f1c8b742
+Create Date: 2026-10-17 14:12:48.203915
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a9d4b2e7c158'
+down_revision: Union[str, Sequence[str], None] = 'e5a3f1c8b742'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_index('ix_location_history_date', 'location_history', ['date'], unique=False, if_not_exists=True)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_location_history_date', table_name='location_history', if_exists=True)
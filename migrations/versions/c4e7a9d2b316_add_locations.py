@@ -0,0 +1,149 @@
+"""Add locations and fold per-user weather_history into location_history
+
+Revision ID: c4e7a9d2b316
+Revises: 8b1d4e6f2a90
+Create Date: 2026-10-16 12:20:45.117093
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+from core.geo import location_key, round_coordinates
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c4e7a9d2b316'
+down_revision: Union[str, Sequence[str], None] = '8b1d4e6f2a90'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+HISTORY_COLUMNS = ('temp_avg', 'temp_min', 'temp_max', 'condition', 'precipitation', 'wind_speed')
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    bind = op.get_bind()
+    inspector = sa.inspect(bind)
+
+    # if_not_exists / inspector checks: init_db's create_all already builds new tables on startup
+    locations = op.create_table('locations',
+    sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+    sa.Column('key', sa.String(), nullable=False),
+    sa.Column('name', sa.String(), nullable=True),
+    sa.Column('latitude', sa.Float(), nullable=False),
+    sa.Column('longitude', sa.Float(), nullable=False),
+    sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.text('(CURRENT_TIMESTAMP)'), nullable=True),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('key'),
+    if_not_exists=True
+    )
+    location_history = op.create_table('location_history',
+    sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+    sa.Column('location_id', sa.Integer(), nullable=False),
+    sa.Column('date', sa.Date(), nullable=False),
+    sa.Column('temp_avg', sa.Float(), nullable=True),
+    sa.Column('temp_min', sa.Float(), nullable=True),
+    sa.Column('temp_max', sa.Float(), nullable=True),
+    sa.Column('condition', sa.String(), nullable=True),
+    sa.Column('precipitation', sa.Float(), nullable=True),
+    sa.Column('wind_speed', sa.Float(), nullable=True),
+    sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.text('(CURRENT_TIMESTAMP)'), nullable=True),
+    sa.ForeignKeyConstraint(['location_id'], ['locations.id'], ),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('location_id', 'date', name='_location_date_uc'),
+    if_not_exists=True
+    )
+
+    if 'location_id' not in {c['name'] for c in inspector.get_columns('cities')}:
+        with op.batch_alter_table('cities', schema=None) as batch_op:
+            batch_op.add_column(sa.Column('location_id', sa.Integer(), nullable=True))
+            batch_op.create_foreign_key('fk_cities_location_id', 'locations', ['location_id'], ['id'])
+    op.create_index('ix_cities_location_id', 'cities', ['location_id'], unique=False, if_not_exists=True)
+
+    # 1. One location per distinct rounded coordinate; link every city to it
+    cities = sa.table('cities', sa.column('id'), sa.column('city_name'), sa.column('latitude'),
+                      sa.column('longitude'), sa.column('location_id'))
+    location_ids = {row.key: row.id for row in bind.execute(sa.select(locations.c.key, locations.c.id))}
+    city_rows = bind.execute(
+        sa.select(cities.c.id, cities.c.city_name, cities.c.latitude, cities.c.longitude)
+        .where(cities.c.latitude.isnot(None), cities.c.longitude.isnot(None))
+        .order_by(cities.c.id)
+    ).all()
+    for city in city_rows:
+        key = location_key(city.latitude, city.longitude)
+        if key not in location_ids:
+            lat, lon = round_coordinates(city.latitude, city.longitude)
+            location_ids[key] = bind.execute(
+                locations.insert().values(key=key, name=city.city_name, latitude=lat, longitude=lon)
+                .returning(locations.c.id)
+            ).scalar_one()
+        bind.execute(cities.update().where(cities.c.id == city.id).values(location_id=location_ids[key]))
+
+    if 'weather_history' not in inspector.get_table_names():
+        return
+
+    # 2. Fold per-user rows into one row per (location, date); the newest row wins
+    weather_history = sa.table('weather_history', sa.column('id'), sa.column('user_id'),
+                               sa.column('city_name'), sa.column('date', sa.Date()), *map(sa.column, HISTORY_COLUMNS))
+    city_link = sa.table('cities', sa.column('user_id'), sa.column('city_name'), sa.column('location_id'))
+    rows = bind.execute(
+        sa.select(city_link.c.location_id, weather_history.c.date, *[weather_history.c[c] for c in HISTORY_COLUMNS])
+        .select_from(weather_history.join(city_link, sa.and_(
+            city_link.c.user_id == weather_history.c.user_id,
+            city_link.c.city_name == weather_history.c.city_name,
+        )))
+        .where(city_link.c.location_id.isnot(None))
+        .order_by(weather_history.c.id)
+    ).all()
+    existing = set(bind.execute(sa.select(location_history.c.location_id, location_history.c.date)).all())
+    folded = {}
+    for row in rows:
+        if (row.location_id, row.date) not in existing:
+            folded[(row.location_id, row.date)] = dict(row._mapping)
+    if folded:
+        op.bulk_insert(location_history, list(folded.values()))
+
+    op.drop_table('weather_history')
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    weather_history = op.create_table('weather_history',
+    sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('city_name', sa.String(), nullable=False),
+    sa.Column('date', sa.Date(), nullable=False),
+    sa.Column('temp_avg', sa.Float(), nullable=True),
+    sa.Column('temp_min', sa.Float(), nullable=True),
+    sa.Column('temp_max', sa.Float(), nullable=True),
+    sa.Column('condition', sa.String(), nullable=True),
+    sa.Column('precipitation', sa.Float(), nullable=True),
+    sa.Column('wind_speed', sa.Float(), nullable=True),
+    sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.text('(CURRENT_TIMESTAMP)'), nullable=True),
+    sa.ForeignKeyConstraint(['user_id'], ['users.user_id'], ),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('user_id', 'city_name', 'date', name='_user_city_date_uc')
+    )
+
+    # Expand each location's history back to every city that points at it
+    bind = op.get_bind()
+    cities = sa.table('cities', sa.column('user_id'), sa.column('city_name'), sa.column('location_id'))
+    location_history = sa.table('location_history', sa.column('location_id'), sa.column('date', sa.Date()),
+                                *map(sa.column, HISTORY_COLUMNS))
+    rows = bind.execute(
+        sa.select(cities.c.user_id, cities.c.city_name, location_history.c.date,
+                  *[location_history.c[c] for c in HISTORY_COLUMNS])
+        .select_from(location_history.join(cities, cities.c.location_id == location_history.c.location_id))
+        .distinct()
+    ).all()
+    if rows:
+        op.bulk_insert(weather_history, [dict(row._mapping) for row in rows])
+
+    op.drop_index('ix_cities_location_id', table_name='cities', if_exists=True)
+    with op.batch_alter_table('cities', schema=None) as batch_op:
+        batch_op.drop_constraint('fk_cities_location_id', type_='foreignkey')
+        batch_op.drop_column('location_id')
+    op.drop_table('location_history')
+    op.drop_table('locations')
@@ -0,0 +1,43 @@
+"""Drop weather_snapshots, superseded by hourly_observations
+
+Revision ID: d2f8c6a41b93
+Revises: a9d4b2e7c158
+Create Date: 2026-10-17 18:40:11.572306
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd2f8c6a41b93'
+down_revision: Union[str, Sequence[str], None] = 'a9d4b2e7c158'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # Nothing reads or writes per-user snapshots since the comparison moved to hourly_observations
+    op.drop_index('ix_weather_snapshots_timestamp', table_name='weather_snapshots', if_exists=True)
+    op.drop_index('ix_weather_snapshots_user_city_ts', table_name='weather_snapshots', if_exists=True)
+    op.drop_table('weather_snapshots', if_exists=True)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.create_table('weather_snapshots',
+    sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=True),
+    sa.Column('city_name', sa.String(), nullable=True),
+    sa.Column('temp', sa.Float(), nullable=True),
+    sa.Column('condition', sa.String(), nullable=True),
+    sa.Column('timestamp', sa.DateTime(timezone=True), server_default=sa.func.now(), nullable=True),
+    sa.ForeignKeyConstraint(['user_id'], ['users.user_id'], ),
+    sa.PrimaryKeyConstraint('id'),
+    if_not_exists=True
+    )
+    op.create_index('ix_weather_snapshots_user_city_ts', 'weather_snapshots', ['user_id', 'city_name', 'timestamp'], unique=False, if_not_exists=True)
+    op.create_index('ix_weather_snapshots_timestamp', 'weather_snapshots', ['timestamp'], unique=False, if_not_exists=True)
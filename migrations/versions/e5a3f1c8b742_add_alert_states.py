@@ -0,0 +1,40 @@
+"""Add alert_states for alert cooldowns and de-duplication
+
+Revision ID: e5a3f1c8b742
+Revises: c4e7a9d2b316
+Create Date: 2026-10-17 09:41:26.530817
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e5a3f1c8b742'
+down_revision: Union[str, Sequence[str], None] = 'c4e7a9d2b316'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # if_not_exists: init_db's create_all already builds it on fresh databases
+    op.create_table('alert_states',
+    sa.Column('scope', sa.String(), nullable=False),
+    sa.Column('alert_type', sa.String(), nullable=False),
+    sa.Column('fingerprint', sa.String(), nullable=False),
+    sa.Column('last_fired_at', sa.DateTime(timezone=True), nullable=False),
+    sa.Column('value', sa.Float(), nullable=True),
+    sa.Column('active', sa.Boolean(), nullable=False),
+    sa.PrimaryKeyConstraint('scope', 'alert_type', 'fingerprint', name='pk_alert_states'),
+    if_not_exists=True
+    )
+    op.create_index('ix_alert_states_last_fired_at', 'alert_states', ['last_fired_at'], unique=False, if_not_exists=True)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_alert_states_last_fired_at', table_name='alert_states', if_exists=True)
+    op.drop_table('alert_states', if_exists=True)
@@ -1,13 +1,28 @@
+import asyncio
 import logging
 import datetime
+import functools
+import time
 import pytz
+from collections import Counter
+from typing import Dict
 from telegram.ext import ContextTypes
+from config import (
+    NOTIFICATION_WORKERS, NOTIFICATION_WEATHER_CONCURRENCY,
+    HISTORY_WORKERS, HISTORY_WRITE_BATCH_SIZE, PRUNE_INTERVAL, ALERT_MORNING_TIME
+)
+from core.workers import run_worker_pool
 from database import (
-    get_all_active_users, update_last_notification, 
-    save_weather_history, get_primary_city
+    get_active_users_with_city,
+    get_active_locations, upsert_location_history, prune_expired_rows
 )
-from weather import get_forecast, get_uv_index, get_air_quality
+from database.write_behind import write_behind, record_last_notification
+from weather import get_weather_bundle
 from recommendations import format_daily_forecast
+from services.notification_schedule import notification_schedule, load_notification_schedule
+from services.delivery import delivery_queue, PRIORITY_BROADCAST
+from smart_alerts import check_smart_alerts, check_morning_alerts
+from services.alert_subscriptions import alert_subscriptions
 
 logger = logging.getLogger(__name__)
 
@@ -21,224 +36,275 @@ def get_greeting(name, hour):
     else:
         return f"Доброй ночи, {name}! 🌙"
 
+def _parse_last_notification(last_notif, user_id):
+    """Normalizes last_notification (datetime or string, depending on backend) to aware UTC."""
+    if isinstance(last_notif, datetime.datetime):
+        if last_notif.tzinfo is None:
+            return last_notif.replace(tzinfo=pytz.utc)
+        return last_notif
+    if isinstance(last_notif, str):
+        # Try multiple date formats
+        for fmt in ["%Y-%m-%d %H:%M:%S", "%Y-%m-%dT%H:%M:%S", "%Y-%m-%d %H:%M:%S.%f", "%Y-%m-%dT%H:%M:%S.%f"]:
+            try:
+                return datetime.datetime.strptime(last_notif, fmt).replace(tzinfo=pytz.utc)
+            except ValueError:
+                continue
+        logger.warning(f"Could not parse last_notification string for user {user_id}: {last_notif}")
+    return None
+
 async def send_daily_notifications(context: ContextTypes.DEFAULT_TYPE):
     """
-    Background task to check and send daily notifications.
-    Runs every 60 seconds, uses a 5-minute window for time matching.
+    Background task to send daily notifications.
+    Runs every 60 seconds but only touches users whose precomputed fire time
+    has come (see services/notification_schedule.py).
     """
     try:
-        users = await get_all_active_users()
+        if not notification_schedule.loaded:
+            await load_notification_schedule()
+
         utc_now = datetime.datetime.now(pytz.utc)
-        
-        logger.debug(f"📋 Checking notifications for {len(users)} active users at UTC {utc_now.strftime('%H:%M:%S')}")
-        
-        for user in users:
-            try:
-                user_id = user['user_id']
-                
-                # Check if user has notifications enabled
-                if not user.get('is_active', True):
-                    continue
-                
-                # Need to fetch city details from new table
-                city_data = await get_primary_city(user_id)
-                
-                if not city_data:
-                    logger.debug(f"⏭ User {user_id}: no primary city, skipping")
-                    continue
-
-                lat = city_data['latitude']
-                lon = city_data['longitude']
-                city_name = city_data['city_name']
-                
-                pref_time_str = user.get('notification_time', '07:00')
-                timezone_str = user.get('timezone', 'Europe/Moscow')
-                sensitivity = user.get('temperature_sensitivity', 'normal')
-                last_notif = user.get('last_notification')
-                name = user.get('user_name') or "друг"
-
-                # Timezone check
-                try:
-                    user_tz = pytz.timezone(timezone_str)
-                    user_local_time = utc_now.astimezone(user_tz)
-                except Exception:
-                    user_tz = pytz.timezone('Europe/Moscow')
-                    user_local_time = utc_now.astimezone(user_tz)
-
-                # Parse preferred notification time
-                try:
-                    pref_hour, pref_minute = map(int, pref_time_str.split(':'))
-                except (ValueError, AttributeError):
-                    pref_hour, pref_minute = 7, 0
-                
-                # Use a 5-minute window for matching to avoid missing notifications
-                # This handles scheduler delays, server load, and clock drift
-                current_total_minutes = user_local_time.hour * 60 + user_local_time.minute
-                pref_total_minutes = pref_hour * 60 + pref_minute
-                
-                time_diff = abs(current_total_minutes - pref_total_minutes)
-                # Also handle midnight wraparound (e.g., pref=23:59, current=00:01)
-                time_diff = min(time_diff, 1440 - time_diff)
-                
-                if time_diff > 2:
-                    continue
-
-                # Once per day check — handle both datetime objects and strings
-                if last_notif:
-                    try:
-                        if isinstance(last_notif, datetime.datetime):
-                            last_notif_dt = last_notif
-                            if last_notif_dt.tzinfo is None:
-                                last_notif_dt = last_notif_dt.replace(tzinfo=pytz.utc)
-                        elif isinstance(last_notif, str):
-                            # Try multiple date formats
-                            for fmt in ["%Y-%m-%d %H:%M:%S", "%Y-%m-%dT%H:%M:%S", "%Y-%m-%d %H:%M:%S.%f", "%Y-%m-%dT%H:%M:%S.%f"]:
-                                try:
-                                    last_notif_dt = datetime.datetime.strptime(last_notif, fmt)
-                                    last_notif_dt = last_notif_dt.replace(tzinfo=pytz.utc)
-                                    break
-                                except ValueError:
-                                    continue
-                            else:
-                                last_notif_dt = None
-                                logger.warning(f"Could not parse last_notification string for user {user_id}: {last_notif}")
-                        else:
-                            last_notif_dt = None
-                        
-                        if last_notif_dt:
-                            last_notif_local = last_notif_dt.astimezone(user_tz)
-                            if last_notif_local.date() == user_local_time.date():
-                                logger.debug(f"⏭ User {user_id}: already notified today")
-                                continue  # Already notified today
-                    except Exception as parse_err:
-                        logger.warning(f"Could not parse last_notification for user {user_id}: {parse_err}")
-
-                logger.info(f"📨 Sending daily notification to user {user_id} (time: {pref_time_str}, tz: {timezone_str}, local: {user_local_time.strftime('%H:%M')})")
-
-                forecast = await get_forecast(lat=lat, lon=lon)
-                if not forecast:
-                    logger.warning(f"No forecast data for user {user_id}, city {city_name}")
-                    continue
-
-                # Fetch UV and AQI for morning notification
-                uv = None
-                aqi = None
-                try:
-                    uv = await get_uv_index(city_name)
-                except Exception as uv_err:
-                    logger.warning(f"Failed to get UV for {city_name}: {uv_err}")
-                try:
-                    aqi = await get_air_quality(city_name)
-                except Exception as aqi_err:
-                    logger.warning(f"Failed to get AQI for {city_name}: {aqi_err}")
-
-                try:
-                    content = format_daily_forecast(forecast, sensitivity, city_name, name, uv_index=uv, aqi_data=aqi)
-                except Exception as fmt_err:
-                    logger.error(f"Error formatting forecast for user {user_id}: {fmt_err}", exc_info=True)
-                    content = "❌ Не удалось сформировать прогноз."
-                    
-                greeting = get_greeting(name, user_local_time.hour)
-                
-                message = f"{greeting}\n\n{content}"
-                
-                await context.bot.send_message(chat_id=user_id, text=message, parse_mode='HTML')
-                await update_last_notification(user_id)
-                logger.info(f"✅ Daily notification sent to user {user_id}")
-
-            except Exception as u_e:
-                logger.error(f"Error processing user {user.get('user_id')}: {u_e}", exc_info=True)
+        for user_id in [u for u, queued in _queued_at.items() if utc_now - queued > datetime.timedelta(days=1)]:
+            del _queued_at[user_id]
+        due = notification_schedule.pop_due(utc_now)
+        if not due:
+            return
+
+        user_ids = []
+        for user_id, fire_at in due:
+            if notification_schedule.is_stale(fire_at, utc_now):
+                logger.debug(f"⏭ User {user_id}: missed slot {fire_at.strftime('%H:%M')} UTC, next one is tomorrow")
+                continue
+            user_ids.append(user_id)
+        if not user_ids:
+            return
+
+        logger.info(f"📋 {len(user_ids)} users due for daily notification at UTC {utc_now.strftime('%H:%M:%S')}")
+        started = time.monotonic()
+
+        # Users, primary cities and preferences of the whole batch in one query
+        try:
+            users = await get_active_users_with_city(user_ids, with_preferences=True)
+        except Exception:
+            # Retry them on the next tick rather than skipping them until tomorrow
+            notification_schedule.requeue(due)
+            raise
+
+        # Sends are only queued here (the delivery queue paces them), so the
+        # tick is bounded by weather fetches, not by Telegram's rate limit
+        weather_limit = asyncio.Semaphore(NOTIFICATION_WEATHER_CONCURRENCY)
+
+        async def handle(user):
+            return await send_daily_notification(context, user, utc_now, weather_limit)
+
+        results = await run_worker_pool(users, handle, NOTIFICATION_WORKERS)
+
+        # Users that were deactivated since being scheduled are not returned by the query
+        summary = Counter(skipped=len(user_ids) - len(users))
+        for user, result in results:
+            if isinstance(result, Exception):
+                summary['failed'] += 1
+                logger.error(f"Error processing user {user['user_id']}: {result}", exc_info=result)
+            else:
+                summary[result] += 1
+
+        elapsed = time.monotonic() - started
+        logger.info(f"📬 Daily notifications done in {elapsed:.2f}s: {summary['queued']} queued, "
+                    f"{summary['skipped']} skipped, {summary['failed']} failed (of {len(user_ids)})")
 
     except Exception as e:
         logger.error(f"Error in daily notification job: {e}", exc_info=True)
 
-async def check_alerts(context: ContextTypes.DEFAULT_TYPE):
+# When each user's daily notification was queued; covers the gap until its
+# last_notification stamp is visible, so a re-run can't queue it twice
+_queued_at: Dict[int, datetime.datetime] = {}
+# Keeps the record_last_notification tasks referenced until they finish
+_notification_tasks = set()
+
+def _on_daily_notification_done(user_id: int, future: asyncio.Future):
+    """Marks the user notified for today once the queued message is actually delivered."""
+    if future.cancelled() or future.exception():
+        _queued_at.pop(user_id, None)
+        if not future.cancelled():
+            logger.error(f"Daily notification to user {user_id} failed: {future.exception()}")
+        return
+    task = asyncio.ensure_future(record_last_notification(user_id))
+    _notification_tasks.add(task)
+    task.add_done_callback(_notification_tasks.discard)
+    logger.info(f"✅ Daily notification sent to user {user_id}")
+
+async def send_daily_notification(context: ContextTypes.DEFAULT_TYPE, user: dict, utc_now: datetime.datetime,
+                                  weather_limit: asyncio.Semaphore) -> str:
     """
-    Runs every 3 hours. Checks for dramatic weather changes in the next 6-12 hours.
-    Simple logic: drop > 10 degrees.
+    Builds one user's daily forecast and queues it for delivery. Returns 'queued' or 'skipped'.
+    `user` comes from iter_active_users_with_city(with_preferences=True).
     """
+    user_id = user['user_id']
+    prefs = user.get('preferences')
+    if prefs and not prefs.get('daily_forecast', True):
+        logger.debug(f"⏭ User {user_id}: daily forecast disabled")
+        return 'skipped'
+
+    city_data = user.get('city')
+
+    if not city_data:
+        logger.debug(f"⏭ User {user_id}: no primary city, skipping")
+        return 'skipped'
+
+    lat = city_data['latitude']
+    lon = city_data['longitude']
+    city_name = city_data['city_name']
+
+    pref_time_str = user.get('notification_time', '07:00')
+    timezone_str = user.get('timezone', 'Europe/Moscow')
+    sensitivity = user.get('temperature_sensitivity', 'normal')
+    name = user.get('user_name') or "друг"
+
     try:
-        users = await get_all_active_users()
-        for user in users:
-            if not user.get('alerts_enabled'):
-                continue
-                
-            user_id = user['user_id']
-            city_data = await get_primary_city(user_id)
-            if not city_data: continue
-            
-            lat, lon = city_data['latitude'], city_data['longitude']
-            name = user['user_name']
-            
-            forecast = await get_forecast(lat=lat, lon=lon)
-            if not forecast or 'list' not in forecast: continue
-            
-            # forecast list is 3-hourly or hourly depending on API, but mapped to list in weather.py
-            # weather.py maps to 'list'. We iterated 1 day.
-            # Let's find max diff.
-            
-            temps = [item['main']['temp'] for item in forecast['list']]
-            if not temps: continue
-            
-            max_t = max(temps)
-            min_t = min(temps)
-            
-            # Simple alert: if drop is massive
-            if (max_t - min_t) > 10:
-                pass 
-                
-    except Exception as e:
-        logger.error(f"Error in alerts job: {e}")
+        user_tz = pytz.timezone(timezone_str)
+    except Exception:
+        user_tz = pytz.timezone('Europe/Moscow')
+    user_local_time = utc_now.astimezone(user_tz)
+
+    # Once per day check (e.g. after a restart inside the grace window)
+    pending = write_behind.pending('last_notification', user_id)
+    last_notif = pending['last_notification'] if pending else _queued_at.get(user_id) or user.get('last_notification')
+    last_notif_dt = _parse_last_notification(last_notif, user_id)
+    if last_notif_dt and last_notif_dt.astimezone(user_tz).date() == user_local_time.date():
+        logger.debug(f"⏭ User {user_id}: already notified today")
+        return 'skipped'
+
+    logger.info(f"📨 Sending daily notification to user {user_id} (time: {pref_time_str}, tz: {timezone_str}, local: {user_local_time.strftime('%H:%M')})")
+
+    # Forecast, UV and AQI for the morning notification come from one request
+    async with weather_limit:
+        bundle = await get_weather_bundle(lat=lat, lon=lon)
+    forecast = bundle.forecast if bundle else None
+    if not forecast:
+        logger.warning(f"No forecast data for user {user_id}, city {city_name}")
+        return 'skipped'
+
+    uv = bundle.uv_index
+    aqi = bundle.air_quality
+
+    try:
+        content = format_daily_forecast(forecast, sensitivity, city_name, name, uv_index=uv, aqi_data=aqi)
+    except Exception as fmt_err:
+        logger.error(f"Error formatting forecast for user {user_id}: {fmt_err}", exc_info=True)
+        content = "❌ Не удалось сформировать прогноз."
+
+    greeting = get_greeting(name, user_local_time.hour)
+
+    message = f"{greeting}\n\n{content}"
+
+    future = delivery_queue.submit(user_id, message, priority=PRIORITY_BROADCAST, parse_mode='HTML')
+    _queued_at[user_id] = utc_now
+    future.add_done_callback(functools.partial(_on_daily_notification_done, user_id))
+    return 'queued'
+
+async def fetch_daily_summary(location: dict):
+    """Today's aggregate for one location, or None when the forecast is unavailable."""
+    bundle = await get_weather_bundle(lat=location['latitude'], lon=location['longitude'])
+    forecast = bundle.forecast if bundle else None
+    if not forecast:
+        return None
+    
+    # Extract stat from list (which assumes 1 day forecast)
+    list_data = forecast['list']
+    temps = [x['main']['temp'] for x in list_data]
+    if not temps:
+        return None
+    
+    return {
+        'temp_avg': sum(temps) / len(temps),
+        'temp_min': min(temps),
+        'temp_max': max(temps),
+        'condition': list_data[0]['weather'][0]['description'], # Roughly
+        'precipitation': 0, # not parsed currently
+        'wind_speed': list_data[0]['wind']['speed']
+    }
 
 async def save_daily_history_job(context: ContextTypes.DEFAULT_TYPE):
     """
     Runs at 23:55 to save today's stats.
+    Fetches each distinct location once (bounded concurrency) and bulk-upserts the results.
     """
     try:
-        users = await get_all_active_users()
-        today_str = datetime.date.today().isoformat()
+        started = time.monotonic()
+        today = datetime.date.today()
+        locations = await get_active_locations()
+        results = await run_worker_pool(locations, fetch_daily_summary, HISTORY_WORKERS)
+        
+        rows = []
+        outcomes = Counter()
+        for location, summary in results:
+            if isinstance(summary, Exception):
+                outcomes['failed'] += 1
+                logger.error(f"Failed to fetch history for location {location['key']}: {summary}")
+            elif summary is None:
+                outcomes['skipped'] += 1
+            else:
+                rows.append(dict(summary, location_id=location['id'], date=today))
         
-        for user in users:
-            city_data = await get_primary_city(user['user_id'])
-            if not city_data: continue
-            
-            lat, lon = city_data['latitude'], city_data['longitude']
-            city_name = city_data['city_name']
-            
-            forecast = await get_forecast(lat=lat, lon=lon)
-            if not forecast: continue
-            
-            # Extract stat from list (which assumes 1 day forecast)
-            list_data = forecast['list']
-            temps = [x['main']['temp'] for x in list_data]
-            
-            if not temps: continue
-            
-            avg_temp = sum(temps) / len(temps)
-            min_temp = min(temps)
-            max_temp = max(temps)
-            
-            data = {
-                'temp_avg': avg_temp,
-                'temp_min': min_temp,
-                'temp_max': max_temp,
-                'condition': list_data[0]['weather'][0]['description'], # Roughly
-                'precipitation': 0, # not parsed currently
-                'wind_speed': list_data[0]['wind']['speed']
-            }
-            
-            await save_weather_history(user['user_id'], city_name, today_str, data)
-            
+        written = 0
+        for i in range(0, len(rows), HISTORY_WRITE_BATCH_SIZE):
+            written += await upsert_location_history(rows[i:i + HISTORY_WRITE_BATCH_SIZE])
+        
+        elapsed = time.monotonic() - started
+        logger.info(
+            f"📜 Daily history: {len(locations)} locations, {written} rows written "
+            f"({outcomes['skipped']} skipped, {outcomes['failed']} failed) in {elapsed:.1f}s"
+        )
     except Exception as e:
         logger.error(f"Error in history job: {e}")
 
+async def prune_old_data_job(context: ContextTypes.DEFAULT_TYPE):
+    """
+    Applies data retention (hourly_observations, location_history, alert_states) in bounded
+    batches, off the interactive request path.
+    """
+    try:
+        started = time.monotonic()
+        report = await prune_expired_rows()
+        elapsed = time.monotonic() - started
+        details = ", ".join(f"{table}: {count}" for table, count in report.items())
+        logger.info(f"🧹 Retention pruning done in {elapsed:.2f}s, rows removed — {details or 'nothing configured'}")
+    except Exception as e:
+        logger.error(f"Error in retention pruning job: {e}", exc_info=True)
+
+def schedule_alert_cohorts(job_queue) -> int:
+    """
+    Ensures every timezone in the alert subscription index has its morning
+    alerts trigger at ALERT_MORNING_TIME local time. Safe to call repeatedly,
+    e.g. after a user switches to a new timezone. Returns the number of cohorts.
+    """
+    at = datetime.time.fromisoformat(ALERT_MORNING_TIME)
+    zones = alert_subscriptions.timezones()
+    for zone in zones:
+        name = f"morning_alerts:{zone}"
+        if job_queue.get_jobs_by_name(name):
+            continue
+        try:
+            tz = pytz.timezone(zone)
+        except pytz.UnknownTimeZoneError:
+            logger.warning(f"Unknown timezone {zone!r}, no morning alerts for its users")
+            continue
+        job_queue.run_daily(
+            check_morning_alerts,
+            time=at.replace(tzinfo=tz),
+            data=zone,
+            name=name,
+            job_kwargs={'misfire_grace_time': 600}
+        )
+        logger.debug(f"🌅 Morning alerts scheduled for {zone} at {ALERT_MORNING_TIME}")
+    return len(zones)
+
 def setup_scheduler(application):
     """
     Configures all scheduled jobs.
     """
     job_queue = application.job_queue
     
-    # Daily Notifications (check every 60 seconds)
+    # Daily Notifications (tick every 60 seconds, only due users are processed)
     # misfire_grace_time=120 means: if job is late by >120s, skip it
     # This is more lenient to handle server load/restarts
     job_queue.run_repeating(
@@ -258,43 +324,31 @@ def setup_scheduler(application):
         job_kwargs={'misfire_grace_time': 600}
     )
     
-    # Smart Alerts - DISABLED due to user feedback (spam)
-    # They were firing too frequently without sufficient state tracking.
-    
-    # Rain - every hour (DISABLED)
-    # job_queue.run_repeating(
-    #     check_rain_alerts, 
-    #     interval=3600, 
-    #     first=30,
-    #     name="rain_alerts",
-    #     job_kwargs={'misfire_grace_time': 60}
-    # )
+    # Retention pruning (batched deletes of expired observations/history)
+    job_queue.run_repeating(
+        prune_old_data_job,
+        interval=PRUNE_INTERVAL,
+        first=120,
+        name="retention_pruning",
+        job_kwargs={'misfire_grace_time': 600}
+    )
     
-    # UV - every 3 hours (optimized from hourly) (DISABLED)
-    # job_queue.run_repeating(
-    #     check_uv_alerts, 
-    #     interval=10800,  # 3 hours instead of 1
-    #     first=40,
-    #     name="uv_alerts",
-    #     job_kwargs={'misfire_grace_time': 120}
-    # )
+    # Smart Alerts: one engine per cycle, gated by cooldown/de-duplication state
+    # (services.alert_state), so they no longer repeat the same alert
     
-    # Air Quality - every 6 hours (DISABLED)
-    # job_queue.run_repeating(
-    #     check_air_quality_alerts, 
-    #     interval=21600, 
-    #     first=50,
-    #     name="air_quality_alerts",
-    #     job_kwargs={'misfire_grace_time': 180}
-    # )
+    # Rain, air quality, severe weather, temperature swing - every hour
+    job_queue.run_repeating(
+        check_smart_alerts,
+        interval=3600,
+        first=30,
+        name="smart_alerts",
+        job_kwargs={'misfire_grace_time': 60}
+    )
     
-    # Severe Weather - every hour (DISABLED)
-    # job_queue.run_repeating(
-    #     check_severe_weather, 
-    #     interval=3600, 
-    #     first=60,
-    #     name="severe_weather_alerts",
-    #     job_kwargs={'misfire_grace_time': 60}
-    # )
+    # UV - every morning, one trigger per timezone cohort
+    cohorts = schedule_alert_cohorts(job_queue)
     
-    logger.info("✅ Scheduler configured: daily notifications every 60s (grace=120s), history daily at 20:55 UTC")
+    logger.info(
+        "✅ Scheduler configured: daily notifications tick every 60s (grace=120s), history daily at 20:55 UTC, "
+        f"smart alerts hourly, morning alerts at {ALERT_MORNING_TIME} local in {cohorts} timezones"
+    )
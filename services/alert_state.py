@@ -0,0 +1,135 @@
+"""
+Alert de-duplication and cooldown state.
+
+Every firing is stored per (scope, alert type, fingerprint) in alert_states,
+with an in-memory copy in front so the alert engine can decide what is
+suppressed without a query, and skip fetching weather for a location when
+every alert type there is still cooling down.
+
+Three checks gate a firing:
+- cooldown: at most one firing of a type per scope every ALERT_COOLDOWNS[type] seconds;
+- de-duplication: an occurrence (fingerprint) fires once while its state row is kept;
+- hysteresis: an ongoing condition (ALERT_HYSTERESIS) stays latched until its
+  value drops below threshold - margin, so values hovering around the
+  threshold don't re-fire.
+"""
+import datetime
+import logging
+from typing import Dict, Optional, Tuple
+from config import ALERT_COOLDOWNS, ALERT_HYSTERESIS, ALERT_STATE_RETENTION_HOURS
+from database import get_alert_states, upsert_alert_states
+
+logger = logging.getLogger(__name__)
+
+def location_scope(key: str, timezone: Optional[str] = None) -> str:
+    # Timezone cohorts at one location are alerted separately, so each keeps its own state
+    return f"location:{key}|{timezone}" if timezone else f"location:{key}"
+
+def user_scope(user_id: int) -> str:
+    return f"user:{user_id}"
+
+def _as_utc(dt: datetime.datetime) -> datetime.datetime:
+    # SQLite hands timestamps back naive
+    return dt.replace(tzinfo=datetime.timezone.utc) if dt.tzinfo is None else dt
+
+class AlertStateStore:
+    """
+    Cached view of alert_states. Changes are kept in memory and written in one
+    bulk upsert per alert cycle by `save()`.
+    """
+
+    def __init__(self, cooldowns: Dict[str, int] = ALERT_COOLDOWNS, hysteresis: Dict[str, float] = ALERT_HYSTERESIS,
+                 retention_hours: int = ALERT_STATE_RETENTION_HOURS):
+        self.cooldowns = cooldowns
+        self.hysteresis = hysteresis
+        self.retention = datetime.timedelta(hours=retention_hours) if retention_hours > 0 else None
+        self._states: Dict[Tuple[str, str, str], dict] = {}
+        self._last_fired: Dict[Tuple[str, str], datetime.datetime] = {}
+        self._dirty: Dict[Tuple[str, str, str], dict] = {}
+        self._loaded = False
+        self.fired = 0
+        self.suppressed = 0
+        self.rearmed = 0
+
+    async def load(self):
+        """Fills the cache from the database once per process."""
+        if self._loaded:
+            return
+        for row in await get_alert_states():
+            row['last_fired_at'] = _as_utc(row['last_fired_at'])
+            self._remember(row)
+        self._loaded = True
+        logger.info(f"🔕 Alert state loaded: {len(self._states)} entries")
+
+    def in_cooldown(self, scope: str, alert_type: str, now: datetime.datetime) -> bool:
+        """True while the type fired at this scope less than its cooldown ago."""
+        cooldown = self.cooldowns.get(alert_type, 0)
+        last = self._last_fired.get((scope, alert_type))
+        return bool(cooldown and last and (now - last).total_seconds() < cooldown)
+
+    def should_fire(self, scope: str, alert_type: str, fingerprint: str, now: datetime.datetime) -> bool:
+        if self.in_cooldown(scope, alert_type, now) or self._is_latched((scope, alert_type, fingerprint), now):
+            self.suppressed += 1
+            return False
+        return True
+
+    def record_fired(self, scope: str, alert_type: str, fingerprint: str, value: Optional[float], now: datetime.datetime):
+        row = {'scope': scope, 'alert_type': alert_type, 'fingerprint': fingerprint,
+               'last_fired_at': now, 'value': value, 'active': True}
+        self._remember(row)
+        self._dirty[(scope, alert_type, fingerprint)] = row
+        self.fired += 1
+
+    def observe(self, scope: str, alert_type: str, value: float, threshold: float):
+        """Re-arms latched occurrences once the value leaves the hysteresis band."""
+        margin = self.hysteresis.get(alert_type)
+        if margin is None or value > threshold - margin:
+            return
+        for key, state in self._states.items():
+            if key[0] == scope and key[1] == alert_type and state['active']:
+                state = dict(state, active=False, value=value)
+                self._states[key] = state
+                self._dirty[key] = state
+                self.rearmed += 1
+
+    async def save(self):
+        """Persists pending changes and forgets entries past the retention window."""
+        rows, self._dirty = list(self._dirty.values()), {}
+        try:
+            await upsert_alert_states(rows)
+        except Exception:
+            # Keep them for the next cycle; the cache already reflects them
+            for row in rows:
+                self._dirty.setdefault((row['scope'], row['alert_type'], row['fingerprint']), row)
+            raise
+        if self.retention:
+            cutoff = datetime.datetime.now(datetime.timezone.utc) - self.retention
+            for key in [k for k, s in self._states.items() if s['last_fired_at'] < cutoff and k not in self._dirty]:
+                del self._states[key]
+            for key in [k for k, last in self._last_fired.items() if last < cutoff]:
+                del self._last_fired[key]
+
+    def stats(self) -> dict:
+        return {
+            'entries': len(self._states),
+            'fired': self.fired,
+            'suppressed': self.suppressed,
+            'rearmed': self.rearmed,
+        }
+
+    def _remember(self, row: dict):
+        self._states[(row['scope'], row['alert_type'], row['fingerprint'])] = row
+        type_key = (row['scope'], row['alert_type'])
+        last = self._last_fired.get(type_key)
+        if last is None or row['last_fired_at'] > last:
+            self._last_fired[type_key] = row['last_fired_at']
+
+    def _is_latched(self, key: Tuple[str, str, str], now: datetime.datetime) -> bool:
+        state = self._states.get(key)
+        if not state or not state['active']:
+            return False
+        # Rows past retention are pruned from the table; treat them as gone here too
+        return not self.retention or now - state['last_fired_at'] < self.retention
+
+# Global store, loaded by the first alert cycle
+alert_states = AlertStateStore()
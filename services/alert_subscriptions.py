@@ -0,0 +1,149 @@
+"""
+Location-level subscription index for smart alerts.
+
+For every location (rounded primary-city coordinates) it keeps the set of
+active users with each alert flag enabled, so an alert pass is "for each
+location, look up subscribers" with no per-user queries. The index is built
+once at startup from users + notification_preferences and updated in place
+when a user toggles a flag, changes city or registers.
+
+Users are also grouped by IANA timezone, so morning alerts can be evaluated
+per timezone cohort at local time instead of for everybody at once.
+"""
+import logging
+from typing import Dict, Iterable, List, Optional, Set
+from core.geo import location_key
+from services.notification_schedule import DEFAULT_TIMEZONE
+
+logger = logging.getLogger(__name__)
+
+# notification_preferences columns an alert can depend on, plus the global users.alerts_enabled switch
+ALERT_FLAGS = (
+    'rain_alerts', 'uv_alerts', 'air_quality_alerts', 'severe_weather_alerts', 'temp_change_alerts', 'alerts_enabled',
+)
+
+def _enabled_flags(user: dict) -> Set[str]:
+    # No preferences row yet means the defaults: every alert enabled
+    prefs = user.get('preferences') or {}
+    flags = {flag for flag in ALERT_FLAGS if flag != 'alerts_enabled' and prefs.get(flag, True) is not False}
+    if user.get('alerts_enabled', True):
+        flags.add('alerts_enabled')
+    return flags
+
+class AlertSubscriptionIndex:
+    """location_key -> flag -> user_ids, plus each indexed user's location, name and flags."""
+
+    def __init__(self):
+        self.loaded = False
+        self._by_location: Dict[str, Dict[str, Set[int]]] = {}
+        self._coords: Dict[str, tuple] = {}
+        # Every indexed user per location, flags or not; the location is kept while any remain
+        self._residents: Dict[str, Set[int]] = {}
+        # user_id -> {'location': key, 'name': str, 'flags': set, 'timezone': str}
+        self._users: Dict[int, dict] = {}
+        self._zones: Dict[str, Set[int]] = {}
+
+    def __len__(self):
+        return len(self._users)
+
+    def __contains__(self, user_id: int):
+        return user_id in self._users
+
+    def index_user(self, user: dict):
+        """
+        (Re)indexes a row from iter_active_users_with_city(with_preferences=True).
+        Inactive users and users without a located primary city are dropped.
+        """
+        self.remove(user['user_id'])
+        city = user.get('city')
+        if not user.get('is_active', True) or not city or city.get('latitude') is None or city.get('longitude') is None:
+            return
+        key = location_key(city['latitude'], city['longitude'])
+        entry = {'location': key, 'name': user.get('user_name') or "друг", 'flags': _enabled_flags(user),
+                 'timezone': user.get('timezone') or DEFAULT_TIMEZONE}
+        self._users[user['user_id']] = entry
+        self._zones.setdefault(entry['timezone'], set()).add(user['user_id'])
+        self._coords.setdefault(key, (city['latitude'], city['longitude']))
+        self._residents.setdefault(key, set()).add(user['user_id'])
+        flags = self._by_location.setdefault(key, {})
+        for flag in entry['flags']:
+            flags.setdefault(flag, set()).add(user['user_id'])
+
+    def remove(self, user_id: int):
+        entry = self._users.pop(user_id, None)
+        if not entry:
+            return
+        cohort = self._zones[entry['timezone']]
+        cohort.discard(user_id)
+        if not cohort:
+            del self._zones[entry['timezone']]
+        flags = self._by_location[entry['location']]
+        for flag in entry['flags']:
+            flags[flag].discard(user_id)
+        residents = self._residents[entry['location']]
+        residents.discard(user_id)
+        if not residents:
+            del self._residents[entry['location']]
+            del self._by_location[entry['location']]
+            del self._coords[entry['location']]
+
+    def set_flag(self, user_id: int, flag: str, enabled: bool):
+        """Applies a single toggle without touching the database."""
+        entry = self._users.get(user_id)
+        if not entry or flag not in ALERT_FLAGS:
+            return
+        users = self._by_location[entry['location']].setdefault(flag, set())
+        if enabled:
+            entry['flags'].add(flag)
+            users.add(user_id)
+        else:
+            entry['flags'].discard(flag)
+            users.discard(user_id)
+
+    def subscribers(self, key: str, required: Iterable[str], timezone: Optional[str] = None) -> List[tuple]:
+        """[(user_id, name)] at the location with every flag in `required` enabled (optionally one cohort)."""
+        flags = self._by_location.get(key, {})
+        sets = [flags.get(flag, set()) for flag in required]
+        if timezone is not None:
+            sets.append(self._zones.get(timezone, set()))
+        user_ids = set.intersection(*sets) if sets else set()
+        return [(uid, self._users[uid]['name']) for uid in sorted(user_ids)]
+
+    def locations(self, timezone: Optional[str] = None) -> List[dict]:
+        """Indexed locations, or only those where the `timezone` cohort lives."""
+        keys = self._coords if timezone is None else {self._users[uid]['location'] for uid in self._zones.get(timezone, ())}
+        return [{'key': key, 'latitude': self._coords[key][0], 'longitude': self._coords[key][1]} for key in keys]
+
+    def timezones(self) -> List[str]:
+        return sorted(self._zones)
+
+    def load(self, users: Iterable[dict]):
+        self._by_location.clear()
+        self._coords.clear()
+        self._residents.clear()
+        self._users.clear()
+        self._zones.clear()
+        for user in users:
+            self.index_user(user)
+        self.loaded = True
+        logger.info(f"🔔 Alert subscriptions indexed: {len(self._users)} users in {len(self._coords)} locations, "
+                    f"{len(self._zones)} timezones")
+
+# Global index shared by the alert engine and settings/city handlers
+alert_subscriptions = AlertSubscriptionIndex()
+
+async def load_alert_subscriptions():
+    from database import iter_active_users_with_city
+    users = []
+    async for page in iter_active_users_with_city(with_preferences=True):
+        users.extend(page)
+    alert_subscriptions.load(users)
+
+async def refresh_user_subscriptions(user_id: int):
+    """Re-reads a user's primary city and flags after they change."""
+    from database import get_active_users_with_city
+    users = await get_active_users_with_city([user_id], with_preferences=True)
+    if users:
+        alert_subscriptions.index_user(users[0])
+    else:
+        alert_subscriptions.remove(user_id)
@@ -0,0 +1,231 @@
+"""
+Outbound Telegram delivery queue.
+
+All broadcast jobs send through one queue that respects Telegram's limits:
+a global token bucket (~30 msg/s), a minimum interval per chat, RetryAfter
+back-off, strict per-chat ordering and priority lanes so alerts overtake
+bulk broadcasts.
+
+Handler replies don't go through the queue: they answer the user directly,
+so TELEGRAM_GLOBAL_RATE stays below Telegram's limit to leave them headroom.
+"""
+import asyncio
+import datetime
+import itertools
+import logging
+import time
+from collections import deque
+from typing import Deque, Dict, Optional
+from telegram.error import BadRequest, NetworkError, RetryAfter
+from config import (
+    TELEGRAM_GLOBAL_RATE, TELEGRAM_PER_CHAT_INTERVAL,
+    TELEGRAM_DELIVERY_WORKERS, TELEGRAM_DELIVERY_MAX_RETRIES
+)
+
+logger = logging.getLogger(__name__)
+
+# Priority lanes (lower is sent first)
+PRIORITY_ALERT = 1
+PRIORITY_BROADCAST = 2
+
+class TokenBucket:
+    """Classic token bucket: `rate` tokens per second, bursts up to `capacity`."""
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else rate
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def pause(self, seconds: float):
+        """Stops handing out tokens for `seconds` (used on flood-control errors)."""
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+        self._tokens = 0
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+class _Outgoing:
+    __slots__ = ('chat_id', 'priority', 'kwargs', 'future', 'attempts')
+
+    def __init__(self, chat_id: int, priority: int, kwargs: dict, future: asyncio.Future):
+        self.chat_id = chat_id
+        self.priority = priority
+        self.kwargs = kwargs
+        self.future = future
+        self.attempts = 0
+
+class DeliveryQueue:
+    """
+    Per-chat FIFO queues scheduled through a priority queue of ready chats.
+    A chat is in the ready queue at most once, so its messages go out one
+    at a time and in order; the chat's lane is its most urgent pending message.
+    """
+
+    def __init__(self, rate: float = TELEGRAM_GLOBAL_RATE, per_chat_interval: float = TELEGRAM_PER_CHAT_INTERVAL,
+                 workers: int = TELEGRAM_DELIVERY_WORKERS, max_retries: int = TELEGRAM_DELIVERY_MAX_RETRIES):
+        self.bucket = TokenBucket(rate)
+        self.per_chat_interval = per_chat_interval
+        self.workers = workers
+        self.max_retries = max_retries
+        self._bot = None
+        self._chats: Dict[int, Deque[_Outgoing]] = {}
+        self._scheduled: set = set()
+        self._next_allowed: Dict[int, float] = {}
+        self._ready: Optional[asyncio.PriorityQueue] = None
+        self._seq = itertools.count()
+        self._tasks = []
+        self._pending = 0
+        self._idle: Optional[asyncio.Event] = None
+        self.sent = 0
+        self.retried = 0
+        self.failed = 0
+
+    @property
+    def running(self) -> bool:
+        return bool(self._tasks)
+
+    def start(self, bot):
+        if self.running:
+            return
+        self._bot = bot
+        self._ready = asyncio.PriorityQueue()
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self._tasks = [asyncio.create_task(self._worker(), name=f"delivery-{i}") for i in range(self.workers)]
+        logger.info(f"📮 Delivery queue started ({self.bucket.rate:g} msg/s, {self.workers} workers)")
+
+    async def stop(self, timeout: float = 30):
+        """Drains pending messages (up to `timeout` seconds) and stops the workers."""
+        if not self.running:
+            return
+        try:
+            await asyncio.wait_for(self._idle.wait(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"Delivery queue stopped with {self._pending} undelivered messages")
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def submit(self, chat_id: int, text: str, priority: int = PRIORITY_BROADCAST, **kwargs) -> asyncio.Future:
+        """Queues a message and returns a future resolved with the sent Message."""
+        if not self.running:
+            raise RuntimeError("Delivery queue is not started")
+        future = asyncio.get_running_loop().create_future()
+        msg = _Outgoing(chat_id, priority, dict(kwargs, text=text), future)
+        self._chats.setdefault(chat_id, deque()).append(msg)
+        self._pending += 1
+        self._idle.clear()
+        if chat_id not in self._scheduled:
+            self._schedule(chat_id)
+        return future
+
+    async def send_message(self, chat_id: int, text: str, priority: int = PRIORITY_BROADCAST, **kwargs):
+        """Queues a message and waits until it is delivered (or finally fails)."""
+        return await self.submit(chat_id, text, priority, **kwargs)
+
+    def stats(self) -> dict:
+        return {
+            'pending': self._pending,
+            'chats': len(self._chats),
+            'sent': self.sent,
+            'retried': self.retried,
+            'failed': self.failed,
+        }
+
+    def _schedule(self, chat_id: int):
+        queue = self._chats.get(chat_id)
+        if not queue:
+            self._chats.pop(chat_id, None)
+            self._scheduled.discard(chat_id)
+            asyncio.get_running_loop().call_later(self.per_chat_interval, self._forget_chat, chat_id)
+            return
+        self._scheduled.add(chat_id)
+        delay = self._next_allowed.get(chat_id, 0) - time.monotonic()
+        if delay > 0:
+            asyncio.get_running_loop().call_later(delay, self._push_ready, chat_id)
+        else:
+            self._push_ready(chat_id)
+
+    def _forget_chat(self, chat_id: int):
+        if chat_id not in self._chats and self._next_allowed.get(chat_id, 0) <= time.monotonic():
+            self._next_allowed.pop(chat_id, None)
+
+    def _push_ready(self, chat_id: int):
+        queue = self._chats.get(chat_id)
+        if not queue:
+            self._scheduled.discard(chat_id)
+            return
+        priority = min(m.priority for m in queue)
+        self._ready.put_nowait((priority, next(self._seq), chat_id))
+
+    def _finish(self, chat_id: int):
+        self._chats[chat_id].popleft()
+        self._pending -= 1
+        if self._pending == 0:
+            self._idle.set()
+
+    async def _worker(self):
+        while True:
+            _, _, chat_id = await self._ready.get()
+            queue = self._chats.get(chat_id)
+            if not queue:
+                self._scheduled.discard(chat_id)
+                continue
+
+            msg = queue[0]
+            await self.bucket.acquire()
+            try:
+                result = await self._bot.send_message(chat_id=chat_id, **msg.kwargs)
+            except RetryAfter as e:
+                delay = e.retry_after
+                if isinstance(delay, datetime.timedelta):
+                    delay = delay.total_seconds()
+                # Flood control applies to the whole bot: pause everyone, keep the message
+                logger.warning(f"Telegram flood control, pausing sends for {delay}s")
+                self.bucket.pause(delay)
+                self._next_allowed[chat_id] = time.monotonic() + delay
+                self.retried += 1
+            except NetworkError as e:
+                # BadRequest is a NetworkError subclass but retrying it is pointless
+                msg.attempts += 1
+                if isinstance(e, BadRequest) or msg.attempts > self.max_retries:
+                    self._fail(chat_id, msg, e)
+                else:
+                    self._next_allowed[chat_id] = time.monotonic() + min(2 ** msg.attempts, 30)
+                    self.retried += 1
+            except Exception as e:
+                self._fail(chat_id, msg, e)
+            else:
+                self.sent += 1
+                self._next_allowed[chat_id] = time.monotonic() + self.per_chat_interval
+                self._finish(chat_id)
+                if not msg.future.done():
+                    msg.future.set_result(result)
+            self._schedule(chat_id)
+
+    def _fail(self, chat_id: int, msg: _Outgoing, error: Exception):
+        self.failed += 1
+        logger.error(f"Failed to deliver message to {chat_id}: {error}")
+        self._finish(chat_id)
+        if not msg.future.done():
+            msg.future.set_exception(error)
+            # Don't warn about unretrieved exceptions for fire-and-forget submits
+            msg.future.exception()
+
+# Global queue, started in post_init with the application's bot
+delivery_queue = DeliveryQueue()
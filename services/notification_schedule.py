@@ -0,0 +1,171 @@
+"""
+Time-indexed schedule of daily notifications.
+
+Each user's next fire time is precomputed in UTC and kept in a min-heap,
+so the scheduler tick only touches users that are actually due instead of
+scanning every active user every minute.
+"""
+import heapq
+import logging
+import datetime
+import pytz
+from typing import Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_NOTIFICATION_TIME = "07:00"
+DEFAULT_TIMEZONE = "Europe/Moscow"
+
+def _parse_time(time_str: str) -> datetime.time:
+    try:
+        hour, minute = map(int, time_str.split(':'))
+        return datetime.time(hour, minute)
+    except (ValueError, AttributeError):
+        return datetime.time(7, 0)
+
+def _get_tz(timezone_str: str):
+    try:
+        return pytz.timezone(timezone_str)
+    except Exception:
+        return pytz.timezone(DEFAULT_TIMEZONE)
+
+def _localize(tz, date: datetime.date, at: datetime.time) -> datetime.datetime:
+    """
+    Localizes a wall-clock time, resolving DST transitions:
+    - a time skipped by spring-forward fires right after the jump (e.g. 02:30 -> 03:30),
+    - a time repeated by fall-back fires once, on its first occurrence.
+    """
+    naive = datetime.datetime.combine(date, at)
+    try:
+        return tz.localize(naive, is_dst=None)
+    except pytz.NonExistentTimeError:
+        return tz.normalize(tz.localize(naive, is_dst=False))
+    except pytz.AmbiguousTimeError:
+        return tz.localize(naive, is_dst=True)
+
+def next_fire_time(notification_time: str, timezone_str: str, not_before: datetime.datetime) -> datetime.datetime:
+    """Returns the first UTC occurrence of the user's local notification time at or after `not_before`."""
+    tz = _get_tz(timezone_str)
+    at = _parse_time(notification_time)
+    local_date = not_before.astimezone(tz).date()
+
+    for offset in (-1, 0, 1, 2):
+        fire_at = _localize(tz, local_date + datetime.timedelta(days=offset), at).astimezone(pytz.utc)
+        if fire_at >= not_before:
+            return fire_at
+    # Unreachable: one of the candidate days is always late enough
+    raise ValueError(f"Could not schedule {notification_time} in {timezone_str}")
+
+class NotificationSchedule:
+    """
+    Min-heap of (fire_at_utc, user_id) with lazy invalidation.
+    Rescheduling a user bumps their version; stale heap entries are skipped on pop.
+    """
+
+    def __init__(self, grace: datetime.timedelta = datetime.timedelta(minutes=2)):
+        self.grace = grace
+        self.loaded = False
+        self._heap: List[Tuple[datetime.datetime, int, int]] = []
+        # user_id -> (version, fire_at, notification_time, timezone)
+        self._entries: Dict[int, Tuple[int, datetime.datetime, str, str]] = {}
+        self._version = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, user_id: int):
+        return user_id in self._entries
+
+    def get_fire_time(self, user_id: int) -> Optional[datetime.datetime]:
+        entry = self._entries.get(user_id)
+        return entry[1] if entry else None
+
+    def schedule(self, user_id: int, notification_time: str = None, timezone_str: str = None,
+                 now: datetime.datetime = None, not_before: datetime.datetime = None) -> datetime.datetime:
+        """
+        (Re)schedules a user. By default the next occurrence is looked up from
+        `now - grace`, so a time that has just passed still fires on this tick.
+        """
+        notification_time = notification_time or DEFAULT_NOTIFICATION_TIME
+        timezone_str = timezone_str or DEFAULT_TIMEZONE
+        if not_before is None:
+            now = now or datetime.datetime.now(pytz.utc)
+            not_before = now - self.grace
+
+        fire_at = next_fire_time(notification_time, timezone_str, not_before)
+        self._version += 1
+        self._entries[user_id] = (self._version, fire_at, notification_time, timezone_str)
+        heapq.heappush(self._heap, (fire_at, user_id, self._version))
+        return fire_at
+
+    def schedule_user(self, user: dict, now: datetime.datetime = None) -> Optional[datetime.datetime]:
+        """Schedules a user from a users-table row, or drops them if they are inactive."""
+        if not user or not user.get('is_active', True):
+            if user:
+                self.remove(user['user_id'])
+            return None
+        return self.schedule(user['user_id'], user.get('notification_time'), user.get('timezone'), now=now)
+
+    def remove(self, user_id: int):
+        # The heap entry becomes stale and is dropped when it surfaces
+        self._entries.pop(user_id, None)
+
+    def pop_due(self, now: datetime.datetime) -> List[Tuple[int, datetime.datetime]]:
+        """
+        Pops every user whose fire time is <= now and schedules their next
+        occurrence. Returns [(user_id, fire_at)] in fire-time order.
+        """
+        due = []
+        while self._heap and self._heap[0][0] <= now:
+            fire_at, user_id, version = heapq.heappop(self._heap)
+            entry = self._entries.get(user_id)
+            if not entry or entry[0] != version:
+                continue
+            due.append((user_id, fire_at))
+            _, _, notification_time, timezone_str = entry
+            self.schedule(user_id, notification_time, timezone_str, not_before=fire_at + datetime.timedelta(minutes=1))
+        return due
+
+    def requeue(self, due: List[Tuple[int, datetime.datetime]]):
+        """
+        Puts entries returned by pop_due back, so the next tick pops them again
+        (e.g. when their users could not be loaded). Removed users stay removed.
+        """
+        for user_id, fire_at in due:
+            entry = self._entries.get(user_id)
+            if entry:
+                heapq.heappush(self._heap, (fire_at, user_id, entry[0]))
+
+    def is_stale(self, fire_at: datetime.datetime, now: datetime.datetime) -> bool:
+        """A fire time missed by more than the grace window (e.g. bot was down) is skipped."""
+        return now - fire_at > self.grace
+
+    def load(self, users: list, now: datetime.datetime = None):
+        self._heap.clear()
+        self._entries.clear()
+        now = now or datetime.datetime.now(pytz.utc)
+        for user in users:
+            try:
+                self.schedule_user(user, now=now)
+            except Exception as e:
+                logger.warning(f"Could not schedule notifications for user {user.get('user_id')}: {e}")
+        self.loaded = True
+        logger.info(f"🗓 Notification schedule built for {len(self._entries)} users")
+
+# Global schedule shared by the scheduler job and settings handlers
+notification_schedule = NotificationSchedule()
+
+async def load_notification_schedule():
+    from database import get_all_active_users
+    users = await get_all_active_users()
+    notification_schedule.load(users)
+
+async def refresh_user_schedule(user_id: int):
+    """Re-reads a user's notification_time/timezone after they change."""
+    from database import get_user
+    user = await get_user(user_id)
+    if user:
+        fire_at = notification_schedule.schedule_user(user)
+        logger.debug(f"🗓 User {user_id} next notification at {fire_at}")
+    else:
+        notification_schedule.remove(user_id)
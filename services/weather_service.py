@@ -1,7 +1,9 @@
 import logging
 import datetime
-from database import get_user, save_weather_snapshot, get_weather_comparison
-from weather import get_forecast, get_current_weather, get_uv_index, get_air_quality
+from database import get_user, get_weather_comparison, commit_unit_of_work
+from database.write_behind import record_hourly_observation
+from core.geo import location_key
+from weather import get_weather_bundle
 from analytics import generate_comparison_text, get_smart_insight, suggest_activities
 from recommendations import get_weather_emoji, get_clothing_advice
 from streak import get_streak_info, get_streak_message
@@ -14,29 +16,37 @@ async def generate_weather_message_content(user_id, city_data):
     lat, lon = city_data['latitude'], city_data['longitude']
     city_name = city_data['city_name']
     
-    # 1. Fetch Data
-    forecast = await get_forecast(lat=lat, lon=lon)
-    current = await get_current_weather(lat=lat, lon=lon)
-    uv = await get_uv_index(city_name)
-    aqi_data = await get_air_quality(city_name)
+    # 1. Database reads first, then commit the update's writes (e.g. the streak)
+    # so no transaction is held while waiting on WeatherAPI and the reply
     user = await get_user(user_id)
+    loc_key = location_key(lat, lon)
+    comp_data = await get_weather_comparison(loc_key)
+    await commit_unit_of_work()
+
+    # 2. Fetch Data (one upstream request for current, forecast, UV and AQI)
+    bundle = await get_weather_bundle(lat=lat, lon=lon)
+    
+    if not bundle: return "Не удалось получить данные о погоде."
+    current = bundle.current
+    forecast = bundle.forecast
+    uv = bundle.uv_index
+    aqi_data = bundle.air_quality
     
     if not current or not forecast: return "Не удалось получить данные о погоде."
 
-    # 2. Comparison
+    # 3. Comparison
     comp_text = ""
-    comp_data = await get_weather_comparison(user_id, city_name)
     if comp_data:
         comp_text = generate_comparison_text(current['main']['temp'], comp_data['temp'])
         comp_text = f"<blockquote>{comp_text}</blockquote>"
     
-    # Save NEW snapshot
+    # Record this hour's observation (shared by everyone in this location)
     try:
-        await save_weather_snapshot(user_id, city_name, current['main']['temp'], current['weather'][0]['description'])
+        await record_hourly_observation(loc_key, current['main']['temp'], current['weather'][0]['description'])
     except Exception as snap_err:
-        logger.warning(f"Failed to save weather snapshot: {snap_err}")
+        logger.warning(f"Failed to record hourly observation: {snap_err}")
 
-    # 3. Format Strings
+    # 4. Format Strings
     temp = current['main']['temp']
     feels = current['main']['feels_like']
     cond = current['weather'][0]['description']
@@ -65,7 +75,7 @@ async def generate_weather_message_content(user_id, city_data):
     # Insight
     smart_text = get_smart_insight({'temp': temp, 'humidity': humid, 'wind': wind/3.6, 'condition_code': current['weather'][0]['id']})
     
-    # 4. Build Forecast Periods Text
+    # 5. Build Forecast Periods Text
     periods_text = "\n\n📅 <b>Прогноз на день</b>\n"
     target_times = {
         "09:00:00": "🌅 Утро",
@@ -1,138 +1,247 @@
 """
 Smart notification system background jobs.
+
+One engine serves every alert type: each cycle takes the subscribers per
+location from the in-memory subscription index (services.alert_subscriptions),
+fetches each location's weather bundle once and evaluates all requested rules
+(rain window, UV, air quality, severe weather, temperature swing) against it
+in a single pass. Matches are then routed to the users of that location who
+have the alert type enabled, so upstream calls scale with locations rather
+than users × alert types, and a cycle makes no per-user queries.
+
+Cooldowns, de-duplication and hysteresis come from services.alert_state:
+locations whose subscribed alert types are all cooling down are not fetched
+at all, and suppressed matches are never routed.
 """
-import logging
 import datetime
-import pytz
+import logging
+import time
+from collections import Counter
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
 from telegram.ext import ContextTypes
-from database import get_all_active_users, get_primary_city, get_notification_preferences, update_notification_preference
-from weather import get_forecast, check_rain_in_next_hours, get_uv_index, get_air_quality, get_severe_weather_alerts
+from config import (
+    ALERT_WORKERS, ALERT_RAIN_WINDOW_HOURS, ALERT_UV_THRESHOLD,
+    ALERT_AQI_THRESHOLD, ALERT_TEMP_SWING
+)
+from core.workers import run_worker_pool
+from weather import get_weather_bundle, WeatherBundle
+from services.delivery import delivery_queue, PRIORITY_ALERT
+from services.alert_state import alert_states, location_scope
+from services.alert_subscriptions import alert_subscriptions, load_alert_subscriptions
 
 logger = logging.getLogger(__name__)
 
-async def check_rain_alerts(context: ContextTypes.DEFAULT_TYPE):
-    """Run every hour."""
-    try:
-        users = await get_all_active_users()
-        utc_now = datetime.datetime.now(pytz.utc)
-        
-        for user in users:
-            uid = user['user_id']
-            prefs = await get_notification_preferences(uid)
-            if not prefs['rain_alerts']: continue
-            
-            # Rate limit check: don't spam. Check last_rain_alert
-            last_alert = prefs['last_rain_alert']
-            if last_alert:
-                # Parse and check if < 6 hours ago
-                pass # Implementation simplified: assume we rely on strict checks or db update
-                
-            city_data = await get_primary_city(uid)
-            if not city_data: continue
-            
-            rain_info = await check_rain_in_next_hours(city_data['city_name'], hours=2)
-            if rain_info and rain_info['will_rain']:
-                # Send alert
-                msg = (f"☔ <b>{user['user_name']}, через час ожидается дождь!</b>\n"
-                       f"🕐 Начало: ~{rain_info['start_time']}\n"
-                       f"💧 Интенсивность: {rain_info['intensity']}\n"
-                       f"Не забудьте взять зонт! ☂️")
-                
-                try:
-                    await context.bot.send_message(uid, msg, parse_mode='HTML')
-                    # Update last alert time
-                    await update_notification_preference(uid, 'last_rain_alert', utc_now.isoformat())
-                except Exception as e:
-                    logger.error(f"Failed to send rain alert to {uid}: {e}")
+@dataclass
+class AlertMatch:
+    """One alert condition found in a location's bundle."""
+    alert_type: str
+    fingerprint: str  # identifies the occurrence, e.g. the WeatherAPI alert or the day
+    value: float = 0  # magnitude (UV index, AQI, ...) the condition was detected at
+    details: dict = field(default_factory=dict)
 
-    except Exception as e:
-        logger.error(f"Error in rain alerts: {e}")
+@dataclass
+class AlertRule:
+    alert_type: str
+    flags: Tuple[str, ...]  # subscription flags a user needs (see services.alert_subscriptions)
+    evaluate: Callable[[WeatherBundle], List[AlertMatch]]
+    render: Callable[[AlertMatch, str], str]  # (match, user name) -> HTML message
+    # For hysteresis: the value the rule compares against `threshold`
+    measure: Optional[Callable[[WeatherBundle], float]] = None
+    threshold: float = 0
 
-async def check_uv_alerts(context: ContextTypes.DEFAULT_TYPE):
-    """Run daily at specific time (e.g. 7 AM user time via scheduler filter/logic)."""
-    # Scheduler calls this.
-    try:
-        users = await get_all_active_users()
-        # For simplicity, we iterate all users. But ideally pass 'users_in_timezone'.
-        
-        for user in users:
-            try:
-                uid = user['user_id']
-                prefs = await get_notification_preferences(uid)
-                if not prefs['uv_alerts']: continue
-                
-                city_data = await get_primary_city(uid)
-                if not city_data: continue
-                
-                uv = await get_uv_index(city_data['city_name'])
-                if uv >= 6:
-                    msg = (f"☀️ <b>{user['user_name']}, сегодня высокий УФ-индекс ({uv})!</b>\n"
-                           "🧴 Не забудьте крем SPF 30+ и очки.")
-                    try:
-                        await context.bot.send_message(uid, msg, parse_mode='HTML')
-                    except Exception as send_err:
-                        logger.error(f"Failed to send UV alert to {uid}: {send_err}")
-            except Exception as user_err:
-                logger.error(f"Error processing UV alert for user {user.get('user_id')}: {user_err}")
+def _local_date(bundle: WeatherBundle) -> str:
+    return (bundle.location.get('localtime') or '')[:10]
 
-    except Exception as e:
-        logger.error(f"Critical error in UV alerts job: {e}")
+def _rain_rule(bundle: WeatherBundle) -> List[AlertMatch]:
+    rain_info = bundle.rain_in_next_hours(hours=ALERT_RAIN_WINDOW_HOURS)
+    if not rain_info['will_rain']:
+        return []
+    return [AlertMatch('rain', f"{_local_date(bundle)} {rain_info['start_time']}",
+                       rain_info.get('chance') or 0, rain_info)]
 
-async def check_air_quality_alerts(context: ContextTypes.DEFAULT_TYPE):
-    """Run every 6 hours."""
-    try:
-        users = await get_all_active_users()
-        for user in users:
-            try:
-                uid = user['user_id']
-                prefs = await get_notification_preferences(uid)
-                if not prefs['air_quality_alerts']: continue
-                
-                city_data = await get_primary_city(uid)
-                if not city_data: continue
-                
-                aqi_data = await get_air_quality(city_data['city_name'])
-                # We computed 'aqi_val' in weather.py
-                aqi_val = aqi_data.get('aqi_val', 0) if aqi_data else 0
-                
-                if aqi_val > 100:
-                    msg = (f"🔴 <b>Внимание! Плохое качество воздуха.</b>\n"
-                           f"AQI: {aqi_val}\n"
-                           "Рекомендуем надеть маску или ограничить время на улице.")
-                    await context.bot.send_message(uid, msg, parse_mode='HTML')
-            except Exception as user_err:
-                logger.error(f"Error processing AQI alert for user {user.get('user_id')}: {user_err}")
+def _render_rain(match: AlertMatch, name: str) -> str:
+    return (f"☔ <b>{name}, через час ожидается дождь!</b>\n"
+            f"🕐 Начало: ~{match.details['start_time']}\n"
+            f"💧 Интенсивность: {match.details['intensity']}\n"
+            f"Не забудьте взять зонт! ☂️")
+
+def _uv_rule(bundle: WeatherBundle) -> List[AlertMatch]:
+    uv = bundle.uv_index
+    if uv < ALERT_UV_THRESHOLD:
+        return []
+    return [AlertMatch('uv', _local_date(bundle), uv)]
+
+def _render_uv(match: AlertMatch, name: str) -> str:
+    return (f"☀️ <b>{name}, сегодня высокий УФ-индекс ({match.value:g})!</b>\n"
+            "🧴 Не забудьте крем SPF 30+ и очки.")
+
+def _aqi_value(bundle: WeatherBundle) -> float:
+    aqi_data = bundle.air_quality
+    return aqi_data.get('aqi_val', 0) if aqi_data else 0
+
+def _air_quality_rule(bundle: WeatherBundle) -> List[AlertMatch]:
+    aqi_val = _aqi_value(bundle)
+    if aqi_val <= ALERT_AQI_THRESHOLD:
+        return []
+    # An ongoing condition rather than an event: one fingerprint per location
+    return [AlertMatch('air_quality', '', aqi_val)]
+
+def _render_air_quality(match: AlertMatch, name: str) -> str:
+    return (f"🔴 <b>Внимание! Плохое качество воздуха.</b>\n"
+            f"AQI: {match.value:g}\n"
+            "Рекомендуем надеть маску или ограничить время на улице.")
 
+def _severe_rule(bundle: WeatherBundle) -> List[AlertMatch]:
+    matches = {}
+    for alert in bundle.alerts:
+        event = alert.get('event') or 'Опасность'
+        fingerprint = f"{alert.get('headline') or event}|{alert.get('effective', '')}"
+        # WeatherAPI often repeats one warning per affected area
+        matches.setdefault(fingerprint, AlertMatch('severe', fingerprint, details={
+            'event': event, 'desc': alert.get('desc', ''),
+        }))
+    return list(matches.values())
+
+def _render_severe(match: AlertMatch, name: str) -> str:
+    return (f"⚠️ <b>ШТОРМОВОЕ ПРЕДУПРЕЖДЕНИЕ: {match.details['event']}</b>\n\n"
+            f"{match.details['desc'][:200]}...")  # Truncate detailed desc
+
+def _temp_swing_rule(bundle: WeatherBundle) -> List[AlertMatch]:
+    forecast = bundle.forecast
+    temps = [item['main']['temp'] for item in forecast['list'] if item['main']['temp'] is not None] if forecast else []
+    if not temps or max(temps) - min(temps) <= ALERT_TEMP_SWING:
+        return []
+    return [AlertMatch('temp_change', _local_date(bundle), max(temps) - min(temps),
+                       {'min': min(temps), 'max': max(temps)})]
+
+def _render_temp_swing(match: AlertMatch, name: str) -> str:
+    return (f"🌡 <b>{name}, сегодня резкий перепад температуры!</b>\n"
+            f"От {match.details['min']:.0f}° до {match.details['max']:.0f}°C — одевайтесь слоями.")
+
+ALERT_RULES: Dict[str, AlertRule] = {rule.alert_type: rule for rule in (
+    AlertRule('rain', ('rain_alerts',), _rain_rule, _render_rain),
+    AlertRule('uv', ('uv_alerts',), _uv_rule, _render_uv),
+    AlertRule('air_quality', ('air_quality_alerts',), _air_quality_rule, _render_air_quality,
+              measure=_aqi_value, threshold=ALERT_AQI_THRESHOLD),
+    AlertRule('severe', ('severe_weather_alerts',), _severe_rule, _render_severe),
+    # The temperature swing alert was always gated by the global alerts switch too
+    AlertRule('temp_change', ('temp_change_alerts', 'alerts_enabled'), _temp_swing_rule, _render_temp_swing),
+)}
+
+# Evaluated by the hourly cycle
+HOURLY_ALERT_TYPES = ('rain', 'air_quality', 'severe', 'temp_change')
+# Evaluated once a day per timezone cohort, at ALERT_MORNING_TIME local time
+MORNING_ALERT_TYPES = ('uv',)
+
+def collect_subscriptions(alert_types: Sequence[str], timezone: Optional[str] = None) -> Dict[str, dict]:
+    """
+    Subscribers per location from the in-memory index, optionally only the
+    users of one timezone cohort:
+    {location_key: {'key', 'latitude', 'longitude', 'scope', 'subscribers': {alert_type: [(user_id, name), ...]}}},
+    where 'scope' keys the location's (cohort's) cooldown and de-dup state.
+    Locations nobody is subscribed to (for these alert types) are left out.
+    """
+    rules = [ALERT_RULES[t] for t in alert_types]
+    locations: Dict[str, dict] = {}
+    for location in alert_subscriptions.locations(timezone):
+        subscribers = {}
+        for rule in rules:
+            users = alert_subscriptions.subscribers(location['key'], rule.flags, timezone)
+            if users:
+                subscribers[rule.alert_type] = users
+        if subscribers:
+            locations[location['key']] = dict(location, scope=location_scope(location['key'], timezone),
+                                              subscribers=subscribers)
+    return locations
+
+async def evaluate_location(location: dict) -> List[AlertMatch]:
+    """Fetches the location's bundle once and runs every rule somebody there subscribes to."""
+    bundle = await get_weather_bundle(lat=location['latitude'], lon=location['longitude'])
+    if not bundle:
+        return []
+    matches = []
+    for alert_type in location['subscribers']:
+        rule = ALERT_RULES[alert_type]
+        try:
+            found = rule.evaluate(bundle)
+            if not found and rule.measure:
+                alert_states.observe(location['scope'], alert_type, rule.measure(bundle), rule.threshold)
+            matches.extend(found)
+        except Exception as e:
+            logger.error(f"Alert rule {alert_type} failed for location {location['key']}: {e}")
+    return matches
+
+def route_match(location: dict, match: AlertMatch) -> int:
+    """Queues the alert for every subscriber of its type at the location."""
+    rule = ALERT_RULES[match.alert_type]
+    queued = 0
+    for user_id, name in location['subscribers'].get(match.alert_type, []):
+        delivery_queue.submit(user_id, rule.render(match, name), priority=PRIORITY_ALERT, parse_mode='HTML')
+        queued += 1
+    return queued
+
+async def run_alert_cycle(alert_types: Sequence[str] = tuple(ALERT_RULES), timezone: Optional[str] = None) -> Counter:
+    """One evaluation pass over every subscribed location (of one timezone cohort) for `alert_types`."""
+    started = time.monotonic()
+    stats = Counter()
+    await alert_states.load()
+    if not alert_subscriptions.loaded:
+        await load_alert_subscriptions()
+    now = datetime.datetime.now(datetime.timezone.utc)
+    locations = collect_subscriptions(alert_types, timezone)
+
+    # Drop alert types still cooling down; a location with nothing left isn't fetched
+    to_fetch = []
+    for location in locations.values():
+        scope = location['scope']
+        for alert_type in [t for t in location['subscribers'] if alert_states.in_cooldown(scope, t, now)]:
+            del location['subscribers'][alert_type]
+        if location['subscribers']:
+            to_fetch.append(location)
+        else:
+            stats['cooling_down'] += 1
+    results = await run_worker_pool(to_fetch, evaluate_location, ALERT_WORKERS)
+
+    for location, matches in results:
+        stats['locations'] += 1
+        if isinstance(matches, Exception):
+            stats['failed'] += 1
+            logger.error(f"Failed to evaluate alerts for location {location['key']}: {matches}")
+            continue
+        scope = location['scope']
+        for match in matches:
+            stats['matches'] += 1
+            if not alert_states.should_fire(scope, match.alert_type, match.fingerprint, now):
+                stats['suppressed'] += 1
+                continue
+            stats['queued'] += route_match(location, match)
+            alert_states.record_fired(scope, match.alert_type, match.fingerprint, match.value, now)
+    await alert_states.save()
+
+    logger.info(
+        f"🚨 Alert cycle ({', '.join(alert_types)}{f' @ {timezone}' if timezone else ''}): {stats['locations']} locations fetched, "
+        f"{stats['cooling_down']} skipped in cooldown, {stats['matches']} matches "
+        f"({stats['suppressed']} suppressed), {stats['queued']} messages queued "
+        f"({stats['failed']} failed) in {time.monotonic() - started:.1f}s"
+    )
+    return stats
+
+async def check_smart_alerts(context: ContextTypes.DEFAULT_TYPE):
+    """Run every hour: rain, air quality, severe weather and temperature swing in one pass."""
+    try:
+        await run_alert_cycle(HOURLY_ALERT_TYPES)
     except Exception as e:
-        logger.error(f"Critical error in AQI alerts job: {e}")
+        logger.error(f"Critical error in smart alerts job: {e}", exc_info=True)
 
-async def check_severe_weather(context: ContextTypes.DEFAULT_TYPE):
-    """Run every hour."""
+async def check_morning_alerts(context: ContextTypes.DEFAULT_TYPE):
+    """Run daily at ALERT_MORNING_TIME in each timezone; job data is the cohort's timezone."""
+    timezone = context.job.data
+    if timezone not in alert_subscriptions.timezones():
+        # Everybody left this timezone; schedule_alert_cohorts re-creates the job if needed
+        context.job.schedule_removal()
+        return
     try:
-        users = await get_all_active_users()
-        for user in users:
-            try:
-                uid = user['user_id']
-                prefs = await get_notification_preferences(uid)
-                if not prefs['severe_weather_alerts']: continue
-                
-                city_data = await get_primary_city(uid)
-                if not city_data: continue
-                
-                alerts = await get_severe_weather_alerts(city_data['city_name'])
-                if alerts:
-                    for alert in alerts:
-                        # Check if recently sent?
-                        # For MVP, send first one.
-                        event = alert.get('event', 'Опасность')
-                        desc = alert.get('desc', '')
-                        msg = (f"⚠️ <b>ШТОРМОВОЕ ПРЕДУПРЕЖДЕНИЕ: {event}</b>\n\n"
-                               f"{desc[:200]}...") # Truncate detailed desc
-                        
-                        await context.bot.send_message(uid, msg, parse_mode='HTML')
-                        break # One alert per check to avoid spam
-            except Exception as user_err:
-                logger.error(f"Error processing severe weather alert for user {user.get('user_id')}: {user_err}")
-                    
+        await run_alert_cycle(MORNING_ALERT_TYPES, timezone)
     except Exception as e:
-        logger.error(f"Critical error in severe weather alerts job: {e}")
+        logger.error(f"Critical error in morning alerts job for {timezone}: {e}", exc_info=True)
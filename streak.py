@@ -2,94 +2,112 @@
 Streak tracking using SQLAlchemy (PostgreSQL/SQLite compatible)
 """
 from database import get_session
-from sqlalchemy import text
+from database.models import User
+from sqlalchemy import text, select, update, case, func, or_, literal
 from datetime import date, datetime, timedelta
 import logging
 
 logger = logging.getLogger(__name__)
 
+users = User.__table__
+
 async def update_streak(user_id: int):
     """
     Update and return user's weather check streak.
     Returns: (current_streak, best_streak, is_new_record)
+
+    While the write-behind buffer runs, the new streak is computed from the
+    pending (or stored) values and queued, so the reply does not wait for a
+    commit. The queued UPDATE only applies over an older check date.
     """
+    from database.write_behind import write_behind, record_streak
+    if not write_behind.running:
+        return await _update_streak_atomic(user_id)
     try:
+        info = write_behind.pending('streak', user_id) or await get_streak_info(user_id)
+        today = date.today()
+        last_check = info['last_check_date']
+        if isinstance(last_check, str):
+            last_check = date.fromisoformat(last_check[:10])
+        current_streak, best_streak = info['current_streak'] or 0, info['best_streak'] or 0
+        if last_check == today:
+            return current_streak, best_streak, False
+
+        current_streak = current_streak + 1 if last_check == today - timedelta(days=1) else 1
+        is_new_record = current_streak > best_streak
+        best_streak = max(best_streak, current_streak)
+        await record_streak(user_id, today, current_streak, best_streak)
+        return current_streak, best_streak, is_new_record
+    except Exception as e:
+        logger.error(f"Error updating streak for user {user_id}: {e}")
+        return 0, 0, False
+
+async def _update_streak_atomic(user_id: int):
+    """
+    One conditional UPDATE ... RETURNING does the whole read-modify-write, so a
+    double tap cannot count the same day twice. RETURNING only sees the new row,
+    so the previous best comes back through an UPDATE ... FROM on the row as it
+    was, and is_new_record means "beat the old record", as in the write-behind
+    path; equalling it doesn't count.
+    """
+    try:
+        today = date.today()
+        yesterday = today - timedelta(days=1)
+        old_current = func.coalesce(users.c.current_streak, 0)
+        old_best = func.coalesce(users.c.best_streak, 0)
+        # SET expressions see the row as it was before the update
+        new_current = case((users.c.last_check_date == yesterday, old_current + 1), else_=1)
+        new_best = case((old_best >= new_current, old_best), else_=new_current)
+        stmt = (
+            update(users)
+            .where(users.c.user_id == user_id)
+            .where(or_(users.c.last_check_date.is_(None), users.c.last_check_date != today))
+            .values(current_streak=new_current, best_streak=new_best, last_check_date=today)
+        )
+
         async with get_session() as session:
-            # Get user's current streak data
+            if session.bind.dialect.name == "postgresql":
+                prev = select(users.c.user_id, old_best.label('old_best')).where(users.c.user_id == user_id).subquery('prev')
+                result = await session.execute(
+                    stmt.where(users.c.user_id == prev.c.user_id)
+                    .returning(users.c.current_streak, users.c.best_streak, prev.c.old_best)
+                )
+            else:
+                # SQLite's RETURNING can't reference FROM tables; read the old best
+                # in the same transaction instead (in-process, no network round trip)
+                previous_best = await session.scalar(select(old_best).where(users.c.user_id == user_id))
+                result = await session.execute(
+                    stmt.returning(users.c.current_streak, users.c.best_streak, literal(previous_best))
+                )
+            row = result.fetchone()
+            if row:
+                current_streak, best_streak, previous_best = row
+                return current_streak, best_streak, current_streak > previous_best
+
+            # No row updated: unknown user, or already checked today
             result = await session.execute(
-                text("SELECT last_check_date, current_streak, best_streak FROM users WHERE user_id = :user_id"),
-                {"user_id": user_id}
+                select(users.c.current_streak, users.c.best_streak).where(users.c.user_id == user_id)
             )
             row = result.fetchone()
-            
             if not row:
                 return 0, 0, False
-            
-            last_check_raw, current_streak, best_streak = row
-            current_streak = current_streak or 0
-            best_streak = best_streak or 0
-            today = date.today()
-            
-            # Handle date parsing from string or date object (SQLAlchemy/DB behavior varies)
-            last_check = None
-            if last_check_raw:
-                if isinstance(last_check_raw, str):
-                    last_check = date.fromisoformat(last_check_raw)
-                elif isinstance(last_check_raw, datetime):
-                    last_check = last_check_raw.date()
-                else:
-                    last_check = last_check_raw
+            return row[0] or 0, row[1] or 0, False
 
-            # Calculate new streak
-            if not last_check:
-                current_streak = 1
-            else:
-                days_diff = (today - last_check).days
-                
-                if days_diff == 1:
-                    # Consecutive day
-                    current_streak += 1
-                elif days_diff == 0:
-                    # Already checked today
-                    return current_streak, best_streak, False
-                else:
-                    # Streak broken
-                    current_streak = 1
-            
-            # Check for new record
-            is_new_record = current_streak > best_streak
-            if is_new_record:
-                best_streak = current_streak
-            
-            # Update database
-            await session.execute(
-                text("""
-                    UPDATE users 
-                    SET last_check_date = :today, 
-                        current_streak = :current_streak,
-                        best_streak = :best_streak
-                    WHERE user_id = :user_id
-                """),
-                {
-                    "today": today.isoformat(),
-                    "current_streak": current_streak,
-                    "best_streak": best_streak,
-                    "user_id": user_id
-                }
-            )
-            
-            return current_streak, best_streak, is_new_record
-            
     except Exception as e:
         logger.error(f"Error updating streak for user {user_id}: {e}")
         return 0, 0, False
 
 async def get_streak_info(user_id: int):
     """
-    Returns user's streak information.
+    Returns user's streak information, including a streak still waiting in
+    the write-behind buffer.
     """
+    from database.write_behind import write_behind
+    pending = write_behind.pending('streak', user_id)
+    if pending:
+        return {k: pending[k] for k in ('current_streak', 'best_streak', 'last_check_date')}
     try:
-        async with get_session() as session:
+        async with get_session(write=False) as session:
             result = await session.execute(
                 text("SELECT current_streak, best_streak, last_check_date FROM users WHERE user_id = :user_id"),
                 {"user_id": user_id}